@@ -0,0 +1,103 @@
+# benchmark_estatisticas.py
+# Compara tempo e pico de memória do resumo estatístico antigo (DataFrame inteiro
+# + describe() + stdout capturado) com o cálculo em blocos de estatisticas_streaming.
+#
+# Uso (a partir de jarvis_backend/):
+#   python benchmarks/benchmark_estatisticas.py --linhas 1000000 5000000
+
+import os
+import io
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing
+from contextlib import redirect_stdout
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource  # Disponível apenas em sistemas Unix
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from estatisticas_streaming import calcular_estatisticas
+
+
+def analise_legada(caminho):
+    """Comportamento anterior de executar_analise_profunda, lendo o arquivo inteiro."""
+    df = pd.read_parquet(caminho) if caminho.endswith(".parquet") else pd.read_csv(caminho)
+    buffer = io.StringIO()
+    with redirect_stdout(buffer):
+        print(df.describe(include=np.number))
+        if not df.select_dtypes(include=['object', 'category']).empty:
+            print(df.describe(include=['object', 'category']))
+    return buffer.getvalue()
+
+FUNCOES = {"legada": analise_legada, "streaming": calcular_estatisticas}
+
+
+def gerar_arquivo(caminho, linhas, linhas_por_bloco=500_000):
+    """Gera um arquivo sintético com colunas numéricas e categóricas, em blocos."""
+    rng = np.random.default_rng(42)
+    categorias = np.array([f"categoria_{i}" for i in range(50)])
+    blocos = []
+    for inicio in range(0, linhas, linhas_por_bloco):
+        n = min(linhas_por_bloco, linhas - inicio)
+        bloco = pd.DataFrame({
+            "id": np.arange(inicio, inicio + n),
+            "valor": rng.normal(100, 25, n),
+            "quantidade": rng.integers(0, 1000, n),
+            "desconto": np.where(rng.random(n) < 0.1, np.nan, rng.random(n)),
+            "categoria": rng.choice(categorias, n),
+            "cidade": rng.choice(["São Paulo", "Rio de Janeiro", "Recife", "Curitiba"], n),
+        })
+        if caminho.endswith(".csv"):
+            bloco.to_csv(caminho, mode="a", header=inicio == 0, index=False)
+        else:
+            blocos.append(bloco)
+    if blocos:
+        pd.concat(blocos).to_parquet(caminho, index=False)
+
+
+def _medir(nome_funcao, caminho, fila):
+    # Roda num processo próprio para que o pico de memória de uma medição não afete a outra
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+    inicio = time.perf_counter()
+    FUNCOES[nome_funcao](caminho)
+    duracao = time.perf_counter() - inicio
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+    fila.put((duracao, (pico - base) / 1024))  # ru_maxrss vem em KB no Linux
+
+
+def medir(nome_funcao, caminho):
+    fila = multiprocessing.Queue()
+    processo = multiprocessing.Process(target=_medir, args=(nome_funcao, caminho, fila))
+    processo.start()
+    resultado = fila.get()
+    processo.join()
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do resumo estatístico em blocos.")
+    parser.add_argument("--linhas", type=int, nargs="+", default=[1_000_000, 5_000_000])
+    parser.add_argument("--formatos", nargs="+", default=["csv", "parquet"], choices=["csv", "parquet"])
+    args = parser.parse_args()
+
+    print(f"{'formato':<8} {'linhas':>10} {'tamanho (MB)':>13} {'função':<10} {'tempo (s)':>10} {'pico extra (MB)':>16}")
+    with tempfile.TemporaryDirectory() as pasta:
+        for formato in args.formatos:
+            for linhas in args.linhas:
+                caminho = os.path.join(pasta, f"dados_{linhas}.{formato}")
+                gerar_arquivo(caminho, linhas)
+                tamanho_mb = os.path.getsize(caminho) / 1024 ** 2
+                for nome_funcao in FUNCOES:
+                    duracao, pico_mb = medir(nome_funcao, caminho)
+                    print(f"{formato:<8} {linhas:>10} {tamanho_mb:>13.1f} {nome_funcao:<10} {duracao:>10.2f} {pico_mb:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# benchmark_handlers.py
+# Executa os endpoints de main.py contra o RepositorioMemoria (sem Supabase nem rede),
+# com uma latência simulada por consulta, e mede pedidos por segundo e idas ao banco.
+#
+# Uso (a partir de jarvis_backend/):
+#   python benchmarks/benchmark_handlers.py --pedidos 500 --concorrencia 50 --latencia-ms 20
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Valores fictícios: nenhum serviço externo é contactado neste benchmark
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+
+import httpx
+import main
+from repositorio import RepositorioMemoria, definir_repositorio
+
+
+async def preparar(repositorio):
+    senha_hash = main.pwd_context.hash("senha")
+    await repositorio.criar_usuario({
+        "nome": "Benchmark", "email": "bench@jarvis.ia", "senha_hash": senha_hash,
+        "role": "admin", "data_expiracao": "9999-12-31T00:00:00+00:00"
+    })
+    for i in range(20):
+        await repositorio.criar_preferencia("bench@jarvis.ia", f"topico_{i}", f"valor_{i}")
+    return main.create_access_token({"sub": "bench@jarvis.ia", "role": "admin"})
+
+
+async def executar(cliente, metodo, url, token, pedidos, concorrencia):
+    semaforo = asyncio.Semaphore(concorrencia)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    async def um_pedido():
+        async with semaforo:
+            resposta = await cliente.request(metodo, url, headers=headers)
+            resposta.raise_for_status()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(um_pedido() for _ in range(pedidos)))
+    return time.perf_counter() - inicio
+
+
+async def main_benchmark(args):
+    repositorio = RepositorioMemoria(latencia_segundos=args.latencia_ms / 1000)
+    definir_repositorio(repositorio)
+    token = await preparar(repositorio)
+
+    cenarios = [
+        ("GET", "/api/preferences"),
+        ("GET", "/api/admin/users"),
+        ("GET", "/api/admin/usage"),
+    ]
+    transporte = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://benchmark") as cliente:
+        print(f"{'endpoint':<24} {'pedidos':>8} {'tempo (s)':>10} {'pedidos/s':>10} {'consultas/pedido':>17}")
+        for metodo, url in cenarios:
+            consultas_antes = repositorio.consultas
+            duracao = await executar(cliente, metodo, url, token, args.pedidos, args.concorrencia)
+            consultas = (repositorio.consultas - consultas_antes) / args.pedidos
+            print(f"{metodo + ' ' + url:<24} {args.pedidos:>8} {duracao:>10.2f} {args.pedidos / duracao:>10.1f} {consultas:>17.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark offline dos endpoints com o repositório em memória.")
+    parser.add_argument("--pedidos", type=int, default=500)
+    parser.add_argument("--concorrencia", type=int, default=50)
+    parser.add_argument("--latencia-ms", type=float, default=20.0)
+    asyncio.run(main_benchmark(parser.parse_args()))
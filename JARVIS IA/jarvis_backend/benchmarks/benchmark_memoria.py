@@ -0,0 +1,68 @@
+# benchmark_memoria.py
+# Mede a latência de busca e o recall@k do índice de memória de longo prazo
+# (memoria_longo_prazo.py) com vetores sintéticos agrupados, sem carregar o modelo
+# de embeddings nem chamar a OpenAI.
+#
+# Uso (a partir de jarvis_backend/):
+#   python benchmarks/benchmark_memoria.py --tamanhos 1000 10000 50000 --consultas 500
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from memoria_longo_prazo import IndiceVetorialUsuario, TOP_K
+
+
+def gerar_vetores(n, dim, rng, n_temas=200):
+    """Vetores normalizados à volta de `n_temas` direções, como factos sobre poucos assuntos."""
+    temas = rng.standard_normal((n_temas, dim)).astype(np.float32)
+    vetores = temas[rng.integers(0, n_temas, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vetores / np.linalg.norm(vetores, axis=1, keepdims=True)
+
+
+def medir(n, dim, consultas, rng):
+    vetores = gerar_vetores(n, dim, rng)
+    with tempfile.TemporaryDirectory() as pasta:
+        indice = IndiceVetorialUsuario(os.path.join(pasta, "usuario"))
+        inicio = time.perf_counter()
+        for i in range(0, n, 1000):
+            # Factos sintéticos únicos; a deduplicação é desativada pela distância entre eles
+            indice.adicionar([f"facto {j}" for j in range(i, min(n, i + 1000))], vetores[i:i + 1000])
+        tempo_insercao = time.perf_counter() - inicio
+
+        perguntas = vetores[rng.integers(0, n, consultas)] + 0.3 * rng.standard_normal((consultas, dim)).astype(np.float32)
+        perguntas /= np.linalg.norm(perguntas, axis=1, keepdims=True)
+
+        todos = np.array(indice.vetores[:indice.n])
+        acertos, tempos = 0, []
+        for pergunta in perguntas:
+            inicio = time.perf_counter()
+            resultado = indice.buscar(pergunta, TOP_K, limiar=-1.0)
+            tempos.append(time.perf_counter() - inicio)
+            exatos = {indice.fatos[i] for i in np.argsort(-(todos @ pergunta))[:TOP_K]}
+            acertos += len(exatos & {texto for texto, _ in resultado})
+
+        tempos = np.array(tempos) * 1000
+        return indice.n, tempo_insercao, np.median(tempos), np.percentile(tempos, 99), acertos / (consultas * TOP_K)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do índice vetorial da memória de longo prazo.")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--consultas", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    print(f"{'factos':>8} {'inserção (s)':>13} {'busca p50 (ms)':>15} {'busca p99 (ms)':>15} {'recall@' + str(TOP_K):>10}")
+    for tamanho in args.tamanhos:
+        n, insercao, p50, p99, recall = medir(tamanho, args.dim, args.consultas, rng)
+        print(f"{n:>8} {insercao:>13.2f} {p50:>15.3f} {p99:>15.3f} {recall:>10.3f}")
@@ -0,0 +1,110 @@
+# benchmark_pdf.py
+# Mede a geração de PDFs de conversas com 1, 100 e 1000 páginas, comparando o
+# carregamento das fontes a cada documento (comportamento anterior de criar_pdf)
+# com as fontes em cache no processo (exportacao_pdf).
+#
+# Uso (a partir de jarvis_backend/):
+#   python benchmarks/benchmark_pdf.py --repeticoes 5
+#   python benchmarks/benchmark_pdf.py --fonte-regular /caminho/DejaVuSans.ttf --fonte-negrito /caminho/DejaVuSans-Bold.ttf
+#   python benchmarks/benchmark_pdf.py --concorrencia 8 --rodadas 5   (verifica renderizações em paralelo)
+
+import os
+import sys
+import time
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import exportacao_pdf
+
+PARAGRAFO = (
+    "O Jarvis analisou os dados enviados e encontrou as seguintes tendências: "
+    "as vendas cresceram de forma consistente no último trimestre, com destaque "
+    "para a região Nordeste, enquanto os custos operacionais permaneceram estáveis. "
+) * 6
+
+
+def gerar_conversa(paginas):
+    # Cada par pergunta/resposta ocupa pouco mais de meia página
+    mensagens = []
+    for i in range(max(1, round(paginas * 1.6))):
+        mensagens.append({"role": "user", "content": f"Pergunta {i + 1}: pode detalhar a análise?"})
+        mensagens.append({"role": "assistant", "content": PARAGRAFO})
+    return mensagens
+
+def contar_paginas(documento):
+    return documento.count(b"/Type /Page") - documento.count(b"/Type /Pages")
+
+def renderizar_sem_cache(titulo, mensagens):
+    exportacao_pdf._fontes_base = None  # Força nova leitura e análise dos .ttf, como antes
+    return exportacao_pdf.renderizar_conversa(titulo, mensagens)
+
+def renderizar_com_cache(titulo, mensagens):
+    return exportacao_pdf.renderizar_conversa(titulo, mensagens)
+
+
+def medir(funcao, mensagens, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        documento = funcao("Benchmark", mensagens)
+        tempos.append(time.perf_counter() - inicio)
+    return statistics.median(tempos), documento
+
+
+def verificar_concorrencia(threads, rodadas):
+    """
+    Renderiza conversas diferentes em paralelo (como /chat/export-pdf via asyncio.to_thread)
+    e confere cada PDF com a mesma conversa renderizada sozinha. Retorna o número de falhas.
+    """
+    conversas = [gerar_conversa(1 + i % 4) for i in range(threads)]
+    esperados = [contar_paginas(exportacao_pdf.renderizar_conversa(f"Conversa {i}", m)) for i, m in enumerate(conversas)]
+
+    def renderizar(i):
+        try:
+            documento = exportacao_pdf.renderizar_conversa(f"Conversa {i}", conversas[i])
+            return contar_paginas(documento) == esperados[i] and documento.rstrip().endswith(b"%%EOF")
+        except Exception as e:
+            print(f"  falha na conversa {i}: {type(e).__name__}: {e}")
+            return False
+
+    falhas = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for _ in range(rodadas):
+            falhas += sum(not ok for ok in executor.map(renderizar, range(threads)))
+    print(f"Renderizações em paralelo: {threads * rodadas - falhas}/{threads * rodadas} corretas")
+    return falhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da exportação de conversas em PDF.")
+    parser.add_argument("--paginas", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--fonte-regular")
+    parser.add_argument("--fonte-negrito")
+    parser.add_argument("--concorrencia", type=int, default=0, help="Threads para a verificação de concorrência (0 = não verificar)")
+    parser.add_argument("--rodadas", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.fonte_regular:
+        exportacao_pdf.FONTES[''] = args.fonte_regular
+    if args.fonte_negrito:
+        exportacao_pdf.FONTES['B'] = args.fonte_negrito
+
+    # Aquece o cache para que a primeira medição "com cache" não inclua a leitura das fontes
+    exportacao_pdf._carregar_fontes_base()
+    print(f"Fonte em uso: {exportacao_pdf.novo_documento()[1]}")
+    if args.concorrencia:
+        sys.exit(1 if verificar_concorrencia(args.concorrencia, args.rodadas) else 0)
+    print(f"{'páginas pedidas':>15} {'páginas geradas':>15} {'tamanho (KB)':>13} {'sem cache (s)':>14} {'com cache (s)':>14}")
+    for paginas in args.paginas:
+        mensagens = gerar_conversa(paginas)
+        tempo_sem_cache, _ = medir(renderizar_sem_cache, mensagens, args.repeticoes)
+        tempo_com_cache, documento = medir(renderizar_com_cache, mensagens, args.repeticoes)
+        print(f"{paginas:>15} {contar_paginas(documento):>15} {len(documento) / 1024:>13.1f} "
+              f"{tempo_sem_cache:>14.4f} {tempo_com_cache:>14.4f}")
+
+
+if __name__ == "__main__":
+    main()
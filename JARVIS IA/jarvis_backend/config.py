@@ -2,7 +2,6 @@
 import os
 from openai import OpenAI
 from dotenv import load_dotenv
-from supabase import create_client, Client
 
 # Carrega as variáveis do arquivo .env (para o ambiente local)
 load_dotenv()
@@ -11,6 +10,12 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 SERPER_API_KEY = os.getenv("SERPER_API_KEY")
 
+# Modo especulativo do chat: começa a resposta enquanto decide se precisa de busca na web
+CHAT_ESPECULATIVO = os.getenv("CHAT_ESPECULATIVO", "false").lower() in ("1", "true", "sim")
+
+# Memória de longo prazo: cada mensagem gera uma chamada extra à OpenAI para extrair factos
+MEMORIA_ATIVA = os.getenv("MEMORIA_LONGO_PRAZO", "false").lower() in ("1", "true", "sim")
+
 # Validação para garantir que a chave de API da OpenAI foi carregada
 if not OPENAI_API_KEY:
     raise ValueError("Chave de API da OpenAI não encontrada! Verifique suas variáveis de ambiente.")
@@ -19,9 +24,9 @@ if not OPENAI_API_KEY:
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
 # --- Conexão Centralizada com o Supabase ---
+# O cliente (assíncrono) é criado no startup da aplicação, em repositorio.py
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 # Configuração de Segurança para JWT
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "uma-chave-padrao-muito-segura-se-a-outra-falhar")
@@ -1,5 +1,33 @@
 # context_cache.py
-# Este arquivo existe apenas para guardar o dicionário de contextos de arquivo,
+# Este arquivo existe apenas para guardar os dicionários de contextos de arquivo,
 # evitando importações circulares entre main.py e core_logic.py.
 
-file_contexts = {}
\ No newline at end of file
+import os
+import threading
+from collections import OrderedDict
+
+# Quantos uploads ficam em memória; os mais antigos são descartados primeiro
+MAX_CONTEXTOS = int(os.getenv("MAX_CONTEXTOS_ARQUIVO", "200"))
+# DataFrames ocupam muito mais do que o texto, por isso o limite é menor
+MAX_CONTEXTOS_TABULARES = int(os.getenv("MAX_CONTEXTOS_TABULARES", "16"))
+
+file_contexts = OrderedDict()
+
+# DataFrames das planilhas enviadas, por context_id -> {nome_do_arquivo: DataFrame}.
+# O texto enviado à IA fica em file_contexts; aqui ficam os dados completos.
+tabular_contexts = OrderedDict()
+
+_lock = threading.Lock()
+
+
+def guardar_contexto(context_id, texto, tabelas=None):
+    """Guarda o contexto de um upload e descarta os mais antigos acima dos limites."""
+    with _lock:
+        file_contexts[context_id] = texto
+        if tabelas:
+            tabular_contexts[context_id] = tabelas
+        while len(file_contexts) > MAX_CONTEXTOS:
+            antigo, _ = file_contexts.popitem(last=False)
+            tabular_contexts.pop(antigo, None)
+        while len(tabular_contexts) > MAX_CONTEXTOS_TABULARES:
+            tabular_contexts.popitem(last=False)
@@ -6,19 +6,27 @@ import requests
 from typing import Optional
 
 # Módulos e conexões do projeto
-from config import openai_client, supabase, SERPER_API_KEY, SECRET_KEY, ALGORITHM
+from config import openai_client, SERPER_API_KEY, SECRET_KEY, ALGORITHM
 from context_cache import file_contexts
 
 # core_logic.py
 import json
+import time
 import asyncio
 from jose import jwt, JWTError
 import requests
 
 # Módulos e conexões do projeto
 from utils import detectar_idioma_com_ia
-from config import openai_client, supabase, SERPER_API_KEY, SECRET_KEY, ALGORITHM
+from config import openai_client, SERPER_API_KEY, SECRET_KEY, ALGORITHM, CHAT_ESPECULATIVO, MEMORIA_ATIVA
+from repositorio import obter_repositorio
 from context_cache import file_contexts
+from especulacao import StreamEspeculativo, metricas_especulacao
+from medicao_uso import medidor_uso, usuario_atual
+from memoria_longo_prazo import recuperar_memorias, agendar_memorizacao
+from montagem_prompt import (
+    bloco_arquivo, bloco_preferencias, bloco_web, montar_mensagens, metricas_cache_prompt, INSTRUCOES_WEB
+)
 
 # ==========================================================
 # === FUNÇÕES DE LÓGICA DO PROJETO
@@ -35,17 +43,17 @@ def get_user_email_from_token(token: str):
     except JWTError as e:
         raise ValueError(f"Token inválido ou expirado: {e}")
 
-def carregar_preferencias_do_usuario(email: str):
+async def carregar_preferencias_do_usuario(email: str):
     """Busca as preferências de um utilizador no Supabase."""
     try:
-        response = supabase.table('preferencias').select('topico, valor').eq('user_email', email).execute()
-        if response.data:
-            return {item['topico']: item['valor'] for item in response.data}
+        preferencias = await obter_repositorio().listar_preferencias(email)
+        if preferencias:
+            return {item['topico']: item['valor'] for item in preferencias}
     except Exception as e:
         print(f"Erro ao carregar preferências: {e}")
     return {}
 
-def adicionar_ou_atualizar_preferencia_manual(email_usuario: str, topico: str, valor: str):
+async def adicionar_ou_atualizar_preferencia_manual(email_usuario: str, topico: str, valor: str):
     """
     Adiciona ou atualiza uma preferência para um utilizador manualmente.
     Retorna (True, "Mensagem de sucesso") ou (False, "Mensagem de erro").
@@ -53,15 +61,10 @@ def adicionar_ou_atualizar_preferencia_manual(email_usuario: str, topico: str, v
     if not email_usuario or not topico or not valor:
         return (False, "E-mail, tópico e valor são obrigatórios.")
     try:
-        dados_para_upsert = {
-            "user_email": email_usuario,
-            "topico": topico.strip().lower(),
-            "valor": valor.strip()
-        }
-        response = supabase.table('preferencias').upsert(
-            dados_para_upsert, on_conflict='user_email, topico'
-        ).execute()
-        if response.data:
+        dados = await obter_repositorio().salvar_preferencia(
+            email_usuario, topico.strip().lower(), valor.strip()
+        )
+        if dados:
             mensagem = f"Preferência '{topico}' guardada com sucesso para {email_usuario}."
             return (True, mensagem)
         else:
@@ -70,10 +73,8 @@ def adicionar_ou_atualizar_preferencia_manual(email_usuario: str, topico: str, v
         return (False, f"Erro inesperado ao guardar preferência: {e}")
 
 
-def precisa_buscar_na_web(pergunta: str):
-    """Usa a IA para determinar se uma pergunta requer uma busca na web,
-    com uma verificação prioritária para uma lista expandida de palavras-chave."""
-    
+def palavra_chave_de_busca(pergunta: str):
+    """Devolve a palavra-chave que obriga a uma busca na web, ou None (sem chamar a IA)."""
     pergunta_lower = pergunta.lower()
     
     # --- LISTA DE PALAVRAS-CHAVE EXPANDIDA ---
@@ -91,7 +92,12 @@ def precisa_buscar_na_web(pergunta: str):
     ]
 
     # Verifica se alguma das palavras-chave está na pergunta
-    triggered_keyword = next((palavra for palavra in palavras_chave_busca if palavra in pergunta_lower), None)
+    return next((palavra for palavra in palavras_chave_busca if palavra in pergunta_lower), None)
+
+def precisa_buscar_na_web(pergunta: str):
+    """Usa a IA para determinar se uma pergunta requer uma busca na web,
+    com uma verificação prioritária para uma lista expandida de palavras-chave."""
+    triggered_keyword = palavra_chave_de_busca(pergunta)
     if triggered_keyword:
         print(f"[DEBUG Web Search] Palavra-chave '{triggered_keyword}' detectada. Forçando busca na web.")
         return True
@@ -106,6 +112,7 @@ def precisa_buscar_na_web(pergunta: str):
         response = openai_client.chat.completions.create(
             model='gpt-4o-mini', messages=[{"role": "user", "content": prompt}], max_tokens=3, temperature=0
         )
+        medidor_uso.registrar(response.usage, 'gpt-4o-mini')
         decisao = response.choices[0].message.content.strip().upper()
         
         print(f"[DEBUG Web Search] Decisão da IA para buscar na web: '{decisao}'")
@@ -144,10 +151,105 @@ def gerar_titulo_conversa(historico: list):
         resposta_modelo = openai_client.chat.completions.create(
             model='gpt-4o-mini', messages=[{"role": "user", "content": prompt}], max_tokens=15
         )
+        medidor_uso.registrar(resposta_modelo.usage, 'gpt-4o-mini')
         return resposta_modelo.choices[0].message.content.strip().replace('"', '')
     except Exception:
         return "Chat"
 
+def montar_bloco_web(message: str):
+    """Busca na web e monta o bloco com os resultados (vai nas dicas do turno, não no prefixo)."""
+    return bloco_web(buscar_na_internet(message))
+
+async def montar_bloco_preferencias(user_email: str):
+    """Monta o bloco com as preferências do utilizador, ou None se não houver nenhuma."""
+    preferencias = await carregar_preferencias_do_usuario(user_email)
+    if preferencias:
+        print("[DEBUG] Preferências encontradas. A injetar contexto no prompt do sistema.") 
+    else:
+        print("[DEBUG] Nenhuma preferência encontrada para este utilizador. A usar prompt padrão.") 
+    return bloco_preferencias(preferencias)
+
+async def buscar_memorias(user_email: str, message: str):
+    """Os factos de longo prazo do utilizador mais relevantes para esta mensagem (top-k)."""
+    if not MEMORIA_ATIVA:
+        return []
+    memorias = await asyncio.to_thread(recuperar_memorias, user_email, message)
+    print(f"[DEBUG] {len(memorias)} memória(s) de longo prazo relevantes para esta mensagem.")
+    return memorias
+
+async def stream_especulativo(message: str, history: list, user_email: str, idioma_usuario: str):
+    """
+    Modo especulativo (CHAT_ESPECULATIVO): inicia a resposta personalizada enquanto
+    `precisa_buscar_na_web` decide. Gera os eventos SSE da resposta escolhida.
+    """
+    # Com uma palavra-chave a busca é certa: especular só geraria custo a cancelar
+    if palavra_chave_de_busca(message):
+        print("[DEBUG Especulação] Palavra-chave de busca detectada. Sem resposta especulativa.")
+        async for evento in stream_com_web(message, history, idioma_usuario):
+            yield evento
+        return
+
+    inicio = time.perf_counter()
+    decisao_web = asyncio.create_task(asyncio.to_thread(precisa_buscar_na_web, message))
+
+    preferencias = await montar_bloco_preferencias(user_email)
+    memorias = await buscar_memorias(user_email, message)
+    mensagens_para_api = montar_mensagens(history, message, idioma_usuario, [preferencias], memorias)
+    especulativo = StreamEspeculativo(mensagens_para_api).iniciar()
+
+    try:
+        precisa_web = await decisao_web
+    except BaseException:
+        especulativo.cancelar()
+        raise
+    tempo_decisao = time.perf_counter() - inicio
+
+    if precisa_web:
+        tokens_saida = especulativo.cancelar()
+        metricas_especulacao.registrar_cancelado(tokens_saida, especulativo.tokens_entrada_estimados)
+        print(f"[DEBUG Especulação] Busca na web necessária. Resposta especulativa cancelada "
+              f"({tokens_saida} tokens de saída e ~{especulativo.tokens_entrada_estimados} de entrada desperdiçados).")
+        async for evento in stream_com_web(message, history, idioma_usuario):
+            yield evento
+        return
+
+    print(f"[DEBUG Especulação] Busca na web não necessária. A enviar a resposta especulativa ({especulativo.tokens_recebidos} tokens já em buffer).")
+    primeiro_envio = None
+    try:
+        async for content in especulativo.textos():
+            if primeiro_envio is None:
+                primeiro_envio = time.perf_counter() - inicio
+                # Sem especulação, o primeiro token só chegaria após a decisão + o TTFT do modelo
+                ttft_sequencial = tempo_decisao + (especulativo.ttft_modelo() or 0)
+                metricas_especulacao.registrar_aproveitado(ttft_sequencial - primeiro_envio)
+            yield f"data: {json.dumps({'text': content, 'lang': idioma_usuario})}\n\n"
+            await asyncio.sleep(0.01)
+    finally:
+        especulativo.cancelar()
+
+async def stream_com_web(message: str, history: list, idioma_usuario: str):
+    """Responde com base nos resultados da busca na web."""
+    contexto_da_web = await asyncio.to_thread(montar_bloco_web, message)
+    mensagens_para_api = montar_mensagens(history, message, idioma_usuario, [INSTRUCOES_WEB], contexto_turno=[contexto_da_web])
+    async for evento in stream_resposta(mensagens_para_api, idioma_usuario):
+        yield evento
+
+async def stream_resposta(mensagens_para_api: list, idioma_usuario: str):
+    """Envia a resposta da OpenAI ao cliente como eventos SSE."""
+    stream = openai_client.chat.completions.create(
+        model="gpt-4o-mini", messages=mensagens_para_api, stream=True,
+        stream_options={"include_usage": True}
+    )
+    for chunk in stream:
+        # O último pedaço não traz texto, apenas o `usage` (com os tokens em cache)
+        if chunk.usage:
+            metricas_cache_prompt.registrar(chunk.usage)
+            medidor_uso.registrar(chunk.usage, "gpt-4o-mini")
+        content = chunk.choices[0].delta.content if chunk.choices else None
+        if content:                
+            yield f"data: {json.dumps({'text': content, 'lang': idioma_usuario})}\n\n"
+            await asyncio.sleep(0.01)
+
 async def stream_chat_generator(message: str, history_json: str, token: str, context_id: str = None):
     """
     Função geradora final que busca preferências, contexto de arquivos e gera a resposta da IA.
@@ -155,6 +257,7 @@ async def stream_chat_generator(message: str, history_json: str, token: str, con
     print("\n--- INICIANDO NOVO PEDIDO DE CHAT ---") # <<< DEBUG >>>
     try:
         user_email = get_user_email_from_token(token)
+        usuario_atual.set(user_email)  # Atribui o uso de tokens deste pedido ao utilizador
         print(f"[DEBUG] Token decodificado com sucesso. E-mail do utilizador: {user_email}") 
 
         # === DETECÇÃO DE IDIOMA NO INÍCIO ===
@@ -162,6 +265,11 @@ async def stream_chat_generator(message: str, history_json: str, token: str, con
         print(f"[DEBUG] Idioma do utilizador detetado: {idioma_usuario}")
         # ==========================================
         
+        history = json.loads(history_json)
+        if MEMORIA_ATIVA:
+            # Extrai factos duradouros desta mensagem em segundo plano, sem atrasar a resposta
+            agendar_memorizacao(user_email, message, history)
+
         # === LÓGICA DE PRIORIZAÇÃO DE CONTEXTO ===
         
         if context_id and context_id in file_contexts:
@@ -174,56 +282,37 @@ async def stream_chat_generator(message: str, history_json: str, token: str, con
             else:
                 contexto_final_para_ia = contexto_arquivo
 
-            prompt_sistema = (
-                f"Você é Jarvis, um assistente prestável e amigável. Responda na língua do utilizador (código: {idioma_usuario}). "
-                "Você deve basear sua resposta *primariamente* no conteúdo dos seguintes arquivos fornecidos pelo usuário:\n\n"
-                f"--- CONTEÚDO DO ARQUIVO ---\n{contexto_final_para_ia}\n--- FIM DO CONTEÚDO ---\n"
-            )
-            mensagens_para_api = [{"role": "system", "content": prompt_sistema}]
+            blocos = [bloco_arquivo(contexto_final_para_ia), await montar_bloco_preferencias(user_email)]
+            memorias = await buscar_memorias(user_email, message)
+            contexto_turno = []
 
-        # PASSO 2: Se não houver contexto de arquivo, então decide se precisa de busca na web.
+        # PASSO 2: Sem contexto de arquivo, o modo especulativo começa a responder enquanto decide sobre a web.
+        elif CHAT_ESPECULATIVO:
+            print("[DEBUG] Modo especulativo ativo. A gerar a resposta enquanto decide sobre a busca na web.")
+            async for evento in stream_especulativo(message, history, user_email, idioma_usuario):
+                yield evento
+            return
+
+        # PASSO 3: Se não houver contexto de arquivo, então decide se precisa de busca na web.
         elif precisa_buscar_na_web(message):
             print("[DEBUG] Decisão: Busca na web é necessária. Nenhum arquivo fornecido.") # <<< DEBUG >>>
-            contexto_da_web = buscar_na_internet(message)
-            prompt_sistema = f"""
-            Você é Jarvis, um assistente de IA que resume notícias da web.
-            INSTRUÇÕES CRÍTICAS: Responda na língua do utilizador (código: {idioma_usuario}).
-            Os resultados da pesquisa já estão no formato de link Markdown `* [Título](URL) - Resumo`. A sua resposta final DEVE manter este formato de link.
-            RESULTADOS DA PESQUISA:
-            {contexto_da_web}
-            """
-            mensagens_para_api = [{"role": "system", "content": prompt_sistema}]              
-             
-             
+            blocos = [INSTRUCOES_WEB]
+            memorias = []
+            contexto_turno = [montar_bloco_web(message)]
                    
         else:
             print("[DEBUG] Decisão: Não é necessária busca na web. A processar com personalização.") 
-            preferencias = carregar_preferencias_do_usuario(user_email)
-            prompt_sistema = f"Você é Jarvis, um assistente prestável e amigável. Responda na língua do utilizador (código: {idioma_usuario})."
-            if preferencias:
-                print("[DEBUG] Preferências encontradas. A injetar contexto no prompt do sistema.") 
-                nome_usuario = preferencias.get('nome', 'utilizador')
-                prompt_sistema += f"\n\nContexto sobre o utilizador ({nome_usuario.capitalize()}): {json.dumps(preferencias, ensure_ascii=False)}. Use essas informações para personalizar as suas respostas sempre que for relevante."
-            else:
-                print("[DEBUG] Nenhuma preferência encontrada para este utilizador. A usar prompt padrão.") 
-            
-            mensagens_para_api = [{"role": "system", "content": prompt_sistema}]
+            blocos = [await montar_bloco_preferencias(user_email)]
+            memorias = await buscar_memorias(user_email, message)
+            contexto_turno = []
 
-        
-        history = json.loads(history_json)
-        mensagens_para_api.extend(history)
-        mensagens_para_api.append({"role": "user", "content": message})
+        # Ordem estável -> variável, para aproveitar o cache de prefixo da OpenAI
+        mensagens_para_api = montar_mensagens(history, message, idioma_usuario, blocos, memorias, contexto_turno)
 
-        print(f"[DEBUG] Prompt final do sistema enviado para a OpenAI:\n---\n{prompt_sistema}\n---") # <<< DEBUG >>>
+        print(f"[DEBUG] Prompt final do sistema enviado para a OpenAI:\n---\n{mensagens_para_api[0]['content']}\n---") # <<< DEBUG >>>
 
-        stream = openai_client.chat.completions.create(
-            model="gpt-4o-mini", messages=mensagens_para_api, stream=True
-        )
-        for chunk in stream:
-            content = chunk.choices[0].delta.content
-            if content:                
-                yield f"data: {json.dumps({'text': content, 'lang': idioma_usuario})}\n\n"
-                await asyncio.sleep(0.01)
+        async for evento in stream_resposta(mensagens_para_api, idioma_usuario):
+            yield evento
                 
     except Exception as e:
         print(f"[DEBUG CRÍTICO] Ocorreu uma exceção no stream_chat_generator: {e}") # <<< DEBUG >>>
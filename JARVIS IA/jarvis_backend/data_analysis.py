@@ -1,23 +1,111 @@
 # data_analysis.py
-import io
+import re
+import json
 import numpy as np
 import pandas as pd
-import plotly.express as px
-from contextlib import redirect_stdout
 from config import openai_client
+from estatisticas_streaming import calcular_estatisticas, cortar_valor
+from medicao_uso import medidor_uso
+from executor_analise import CacheLRU, executor_analise, hash_texto
 
-def executar_analise_profunda(df):
-    buffer = io.StringIO()
-    with redirect_stdout(buffer):
-        print("--- RESUMO ESTATÍSTICO (NUMÉRICO) ---\n")
-        print(df.describe(include=np.number))
-        print("\n\n--- RESUMO CATEGÓRICO ---\n")
-        if not df.select_dtypes(include=['object', 'category']).empty:
-            print(df.describe(include=['object', 'category']))
-        else:
-            print("Nenhuma coluna de texto (categórica) encontrada.")
-        
-    return buffer.getvalue()
+# Código gerado pela IA, por hash do prompt (mesma pergunta sobre o mesmo schema)
+codigos_gerados = CacheLRU(256)
+
+# Limites do resumo de planilhas enviado à IA
+MAX_COLUNAS_RESUMO = 40
+ORCAMENTO_RESUMO = 20000  # Caracteres (~5 mil tokens), bem abaixo do corte de core_logic
+
+def executar_analise_profunda(fonte):
+    """
+    Resumo estatístico (numérico e categórico) de um DataFrame ou de um arquivo
+    CSV/Parquet, calculado em blocos para caber na memória mesmo com arquivos grandes.
+    Retorna um dicionário no formato de `estatisticas_streaming.calcular_estatisticas`.
+    """
+    return calcular_estatisticas(fonte)
+
+def amostra_estratificada(df, n_linhas=20, max_categorias=20, semente=42):
+    """
+    Retorna até `n_linhas` linhas representativas do DataFrame.
+    Se existir uma coluna categórica com poucas categorias, pega algumas linhas
+    de cada categoria; caso contrário, pega linhas espaçadas uniformemente.
+    """
+    if len(df) <= n_linhas:
+        return df
+
+    # Percorre as colunas por posição: nomes de colunas podem repetir-se
+    for posicao, tipo in enumerate(df.dtypes):
+        if not (pd.api.types.is_object_dtype(tipo) or isinstance(tipo, (pd.CategoricalDtype, pd.StringDtype))):
+            continue
+        n_categorias = df.iloc[:, posicao].nunique()
+        if 1 < n_categorias <= max_categorias:
+            por_categoria = max(1, n_linhas // n_categorias)
+            embaralhado = df.sample(frac=1, random_state=semente)
+            amostra = embaralhado.groupby(embaralhado.iloc[:, posicao], observed=True, sort=False).head(por_categoria)
+            return amostra.head(n_linhas).sort_index()
+
+    posicoes = np.unique(np.linspace(0, len(df) - 1, n_linhas).astype(int))
+    return df.iloc[posicoes]
+
+def resumir_dataframe(df, n_linhas_amostra=20, orcamento=ORCAMENTO_RESUMO):
+    """
+    Gera uma representação compacta de uma planilha para enviar à IA:
+    dimensões, schema com tipos e nulos, resumo estatístico e uma amostra de linhas.
+    O texto cabe em `orcamento` caracteres: só as primeiras MAX_COLUNAS_RESUMO colunas
+    entram, textos longos são cortados e, se preciso, saem colunas inteiras do resumo
+    estatístico e linhas da amostra (o JSON nunca fica cortado a meio).
+    """
+    n_colunas = df.shape[1]
+    visiveis = df.iloc[:, :MAX_COLUNAS_RESUMO]
+
+    nulos = visiveis.isna().sum().to_numpy()
+    linhas_schema = [
+        f"- {cortar_valor(str(coluna))}: {tipo} ({n_nulos} nulos)"
+        for coluna, tipo, n_nulos in zip(visiveis.columns, visiveis.dtypes, nulos)
+    ]
+    if n_colunas > MAX_COLUNAS_RESUMO:
+        linhas_schema.append(f"- ... mais {n_colunas - MAX_COLUNAS_RESUMO} colunas omitidas do resumo")
+    cabecalho = (
+        f"Planilha com {len(df)} linhas e {n_colunas} colunas "
+        "(resumo tabular: as linhas completas não foram enviadas).\n\n"
+        f"--- SCHEMA (coluna: tipo) ---\n" + "\n".join(linhas_schema) + "\n\n"
+    )
+
+    estatisticas = executar_analise_profunda(visiveis)
+    colunas_estatisticas = [("numericas", nome) for nome in estatisticas["numericas"]]
+    colunas_estatisticas += [("categoricas", nome) for nome in estatisticas["categoricas"]]
+    while True:
+        texto = cabecalho + f"--- RESUMO ESTATÍSTICO (JSON) ---\n{json.dumps(estatisticas, ensure_ascii=False, default=str)}\n\n"
+        # Reserva ~1/4 do orçamento para a amostra de linhas
+        if len(texto) <= orcamento * 3 // 4 or not colunas_estatisticas:
+            break
+        tipo, nome = colunas_estatisticas.pop()
+        del estatisticas[tipo][nome]
+        estatisticas["colunas_omitidas"] = estatisticas.get("colunas_omitidas", 0) + 1
+
+    n_linhas = min(len(df), n_linhas_amostra)
+    amostra_completa = amostra_estratificada(visiveis, n_linhas).map(cortar_valor)
+    while n_linhas > 0:
+        amostra = amostra_completa.head(n_linhas).to_csv(index=False)
+        secao = f"--- AMOSTRA DE LINHAS ({n_linhas} de {len(df)}) ---\n{amostra}"
+        if len(texto) + len(secao) <= orcamento:
+            return texto + secao
+        n_linhas //= 2
+    return texto + "--- AMOSTRA DE LINHAS ---\n(omitida: não cabe no limite do resumo)"
+
+def gerar_codigo_analise(prompt_gerador_codigo):
+    """Pede à IA o código de análise; respostas iguais ficam em cache pelo hash do prompt."""
+    chave = hash_texto(prompt_gerador_codigo)
+    codigo = codigos_gerados.get(chave)
+    if codigo is None:
+        resposta = openai_client.chat.completions.create(
+            model='gpt-4o-mini', messages=[{"role": "user", "content": prompt_gerador_codigo}], temperature=0
+        )
+        medidor_uso.registrar(resposta.usage, 'gpt-4o-mini')
+        codigo = resposta.choices[0].message.content.strip()
+        # Remove as cercas de Markdown (```python ... ```) se a IA as incluir
+        codigo = re.sub(r"^```(?:python)?\s*|\s*```$", "", codigo)
+        codigos_gerados.set(chave, codigo)
+    return codigo
 
 def analisar_dados_com_ia(prompt_usuario, df):
     schema = df.head().to_string()
@@ -32,18 +120,10 @@ def analisar_dados_com_ia(prompt_usuario, df):
     - Use `numeric_only=True` em agregações.
     """
     try:
-             
-                
-        codigo_gerado = "..." 
-        local_vars = {"df": df, "pd": pd, "px": px}
-        exec(codigo_gerado, local_vars)
-
-        if "fig" in local_vars:
-            
-            return {"type": "plot", "content": local_vars["fig"].to_json()}
-        
-        resumo_claro = "..." 
-        return {"type": "text", "content": resumo_claro}
+        codigo_gerado = gerar_codigo_analise(prompt_gerador_codigo)
+        # O código roda num processo separado, com limites de CPU, memória e tempo;
+        # o gráfico já volta serializado (fig.to_json()) pelo processo de trabalho.
+        return executor_analise.executar(codigo_gerado, df)
     except Exception as e:
         
-        return {"type": "text", "content": f"Erro na análise: {e}"}
\ No newline at end of file
+        return {"type": "text", "content": f"Erro na análise: {e}"}
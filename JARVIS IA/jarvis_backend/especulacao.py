@@ -0,0 +1,139 @@
+# especulacao.py
+# Geração especulativa: enquanto o roteador decide se a pergunta precisa de busca
+# na web, a resposta "normal" (sem web) já começa a ser gerada e fica em buffer.
+# Se a busca não for necessária, o buffer é enviado de imediato; caso contrário,
+# a geração é cancelada e os tokens já gerados contam como desperdício.
+
+import time
+import asyncio
+import threading
+from config import openai_client
+from medicao_uso import medidor_uso
+from montagem_prompt import metricas_cache_prompt
+
+
+class MetricasEspeculacao:
+    """Contadores acumulados do modo especulativo, para calibrar o seu uso."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pedidos = 0
+        self.aproveitados = 0
+        self.cancelados = 0
+        self.ganho_ttft_total = 0.0
+        self.tokens_saida_desperdicados = 0
+        self.tokens_entrada_desperdicados = 0
+
+    def registrar_aproveitado(self, ganho_ttft_segundos):
+        with self._lock:
+            self.pedidos += 1
+            self.aproveitados += 1
+            self.ganho_ttft_total += ganho_ttft_segundos
+
+    def registrar_cancelado(self, tokens_saida, tokens_entrada):
+        with self._lock:
+            self.pedidos += 1
+            self.cancelados += 1
+            self.tokens_saida_desperdicados += tokens_saida
+            self.tokens_entrada_desperdicados += tokens_entrada
+
+    def resumo(self):
+        with self._lock:
+            tokens_desperdicados = self.tokens_saida_desperdicados + self.tokens_entrada_desperdicados
+            return {
+                "pedidos": self.pedidos,
+                "aproveitados": self.aproveitados,
+                "cancelados": self.cancelados,
+                "taxa_aproveitamento": self.aproveitados / self.pedidos if self.pedidos else None,
+                "ganho_medio_ttft_ms": 1000 * self.ganho_ttft_total / self.aproveitados if self.aproveitados else None,
+                "tokens_desperdicados": tokens_desperdicados,
+                "tokens_saida_desperdicados": self.tokens_saida_desperdicados,
+                "tokens_entrada_desperdicados": self.tokens_entrada_desperdicados,
+                "tokens_desperdicados_por_cancelamento": tokens_desperdicados / self.cancelados if self.cancelados else None,
+            }
+
+
+metricas_especulacao = MetricasEspeculacao()
+
+
+class StreamEspeculativo:
+    """
+    Consome um stream da OpenAI numa thread e guarda os pedaços de texto numa fila
+    assíncrona, que serve de buffer até a resposta ser aproveitada ou cancelada.
+    """
+
+    def __init__(self, mensagens, modelo="gpt-4o-mini"):
+        self.mensagens = mensagens
+        self.modelo = modelo
+        self.fila = asyncio.Queue()
+        self.cancelado = threading.Event()
+        self.tokens_recebidos = 0  # Cada pedaço do stream corresponde, em geral, a um token
+        # O prompt é cobrado mesmo se a geração for cancelada; ~4 caracteres por token
+        self.tokens_entrada_estimados = max(1, sum(len(str(m.get("content", ""))) for m in mensagens) // 4)
+        self.inicio = None
+        self.primeiro_token_em = None
+
+    def iniciar(self):
+        self._loop = asyncio.get_running_loop()
+        self.inicio = time.perf_counter()
+        self._tarefa = asyncio.create_task(asyncio.to_thread(self._consumir))
+        return self
+
+    def _publicar(self, item):
+        try:
+            self._loop.call_soon_threadsafe(self.fila.put_nowait, item)
+        except RuntimeError:
+            # O event loop já foi encerrado (ex.: cliente desligou)
+            self.cancelado.set()
+
+    def _consumir(self):
+        try:
+            stream = openai_client.chat.completions.create(
+                model=self.modelo, messages=self.mensagens, stream=True,
+                stream_options={"include_usage": True}
+            )
+            uso_registrado = False
+            try:
+                for chunk in stream:
+                    if self.cancelado.is_set():
+                        break
+                    if chunk.usage:
+                        uso_registrado = True
+                        metricas_cache_prompt.registrar(chunk.usage)
+                        medidor_uso.registrar(chunk.usage, self.modelo)
+                    content = chunk.choices[0].delta.content if chunk.choices else None
+                    if content:
+                        if self.primeiro_token_em is None:
+                            self.primeiro_token_em = time.perf_counter()
+                        self.tokens_recebidos += 1
+                        self._publicar(content)
+            finally:
+                stream.close()
+                if not uso_registrado:
+                    # Cancelado antes do `usage`: regista a estimativa em nome do utilizador atual
+                    medidor_uso.registrar_estimativa(self.tokens_entrada_estimados, self.tokens_recebidos, self.modelo)
+        except Exception as e:
+            self._publicar(e)
+        finally:
+            self._publicar(None)
+
+    async def textos(self):
+        """Entrega os pedaços de texto (primeiro os que estão em buffer, depois os novos)."""
+        while True:
+            item = await self.fila.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def ttft_modelo(self):
+        """Tempo entre o início da geração e o primeiro token recebido da OpenAI."""
+        if self.primeiro_token_em is None:
+            return None
+        return self.primeiro_token_em - self.inicio
+
+    def cancelar(self):
+        """Interrompe a geração e devolve quantos tokens de saída foram gerados em vão."""
+        self.cancelado.set()
+        return self.tokens_recebidos
@@ -0,0 +1,211 @@
+# estatisticas_streaming.py
+# Estatísticas descritivas calculadas bloco a bloco, sem carregar o arquivo
+# inteiro na memória. Cada bloco gera estatísticas parciais (momentos, esboço de
+# quantis e contagens de categorias) que são combinadas com as dos blocos anteriores.
+
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+LINHAS_POR_BLOCO = 200_000
+CAPACIDADE_SKETCH = 512       # Pontos mantidos pelo esboço de quantis de cada coluna
+CAPACIDADE_CATEGORIAS = 10_000  # Categorias distintas mantidas por coluna
+TOP_K = 10
+MAX_CARACTERES_VALOR = 80     # Textos longos (texto livre) são cortados nos resultados e resumos
+QUANTIS = (0.25, 0.5, 0.75)
+
+
+class SketchQuantis:
+    """
+    Esboço de quantis combinável: guarda no máximo `capacidade` pontos (valor, peso).
+    Quando passa do limite, pontos vizinhos na ordenação são agrupados em médias ponderadas.
+    """
+
+    def __init__(self, capacidade=CAPACIDADE_SKETCH):
+        self.capacidade = capacidade
+        self.valores = np.empty(0)
+        self.pesos = np.empty(0)
+
+    def adicionar(self, valores):
+        valores = valores[~np.isnan(valores)]
+        if valores.size == 0:
+            return
+        self.valores = np.concatenate([self.valores, valores])
+        self.pesos = np.concatenate([self.pesos, np.ones(valores.size)])
+        if self.valores.size > self.capacidade:
+            self._comprimir()
+
+    def _comprimir(self):
+        ordem = np.argsort(self.valores, kind="stable")
+        valores, pesos = self.valores[ordem], self.pesos[ordem]
+        acumulado = np.cumsum(pesos)
+        # Cada ponto vai para o grupo correspondente à posição do seu centro na distribuição
+        grupos = ((acumulado - pesos / 2) / acumulado[-1] * self.capacidade).astype(int)
+        grupos = np.minimum(grupos, self.capacidade - 1)
+        soma_pesos = np.bincount(grupos, weights=pesos, minlength=self.capacidade)
+        soma_valores = np.bincount(grupos, weights=valores * pesos, minlength=self.capacidade)
+        preenchidos = soma_pesos > 0
+        self.valores = soma_valores[preenchidos] / soma_pesos[preenchidos]
+        self.pesos = soma_pesos[preenchidos]
+
+    def quantil(self, q):
+        if self.valores.size == 0:
+            return None
+        ordem = np.argsort(self.valores, kind="stable")
+        valores, pesos = self.valores[ordem], self.pesos[ordem]
+        posicoes = np.cumsum(pesos) - pesos / 2
+        return float(np.interp(q * pesos.sum(), posicoes, valores))
+
+
+class EstatisticasNumericas:
+    """Contagem, média, variância (combinação de Chan), mínimo, máximo e quantis de uma coluna."""
+
+    def __init__(self):
+        self.n = 0
+        self.media = 0.0
+        self.m2 = 0.0
+        self.minimo = np.inf
+        self.maximo = -np.inf
+        self.sketch = SketchQuantis()
+
+    def adicionar(self, valores):
+        valores = valores[~np.isnan(valores)]
+        n_bloco = valores.size
+        if n_bloco == 0:
+            return
+        media_bloco = float(valores.mean())
+        m2_bloco = float(((valores - media_bloco) ** 2).sum())
+
+        n_total = self.n + n_bloco
+        delta = media_bloco - self.media
+        self.media += delta * n_bloco / n_total
+        self.m2 += m2_bloco + delta ** 2 * self.n * n_bloco / n_total
+        self.n = n_total
+        self.minimo = min(self.minimo, float(valores.min()))
+        self.maximo = max(self.maximo, float(valores.max()))
+        self.sketch.adicionar(valores)
+
+    def resultado(self):
+        if self.n == 0:
+            return {"count": 0, "mean": None, "std": None, "min": None, "max": None,
+                    **{f"{int(q * 100)}%": None for q in QUANTIS}}
+        resultado = {
+            "count": self.n,
+            "mean": self.media,
+            "std": float(np.sqrt(self.m2 / (self.n - 1))) if self.n > 1 else None,
+            "min": self.minimo,
+        }
+        for q in QUANTIS:
+            # O esboço é aproximado; os extremos exatos limitam o valor
+            resultado[f"{int(q * 100)}%"] = min(max(self.sketch.quantil(q), self.minimo), self.maximo)
+        resultado["max"] = self.maximo
+        return resultado
+
+
+class EstatisticasCategoricas:
+    """Contagem de valores de uma coluna de texto, limitada a CAPACIDADE_CATEGORIAS categorias."""
+
+    def __init__(self, capacidade=CAPACIDADE_CATEGORIAS):
+        self.capacidade = capacidade
+        self.n = 0
+        self.contagens = Counter()
+        self.truncado = False
+
+    def adicionar(self, serie):
+        contagens_bloco = serie.value_counts(dropna=True)
+        self.n += int(contagens_bloco.sum())
+        self.contagens.update(dict(zip(contagens_bloco.index.astype(str), contagens_bloco.to_numpy().tolist())))
+        if len(self.contagens) > self.capacidade:
+            # Mantém só as mais frequentes; as contagens passam a ser aproximadas
+            self.contagens = Counter(dict(self.contagens.most_common(self.capacidade)))
+            self.truncado = True
+
+    def resultado(self):
+        mais_frequentes = [(cortar_valor(valor), contagem) for valor, contagem in self.contagens.most_common(TOP_K)]
+        return {
+            "count": self.n,
+            "unique": None if self.truncado else len(self.contagens),
+            "top": mais_frequentes[0][0] if mais_frequentes else None,
+            "freq": mais_frequentes[0][1] if mais_frequentes else None,
+            "top_k": [{"valor": valor, "contagem": contagem} for valor, contagem in mais_frequentes],
+            "aproximado": self.truncado,
+        }
+
+
+def cortar_valor(valor):
+    if isinstance(valor, str) and len(valor) > MAX_CARACTERES_VALOR:
+        return valor[:MAX_CARACTERES_VALOR] + "…"
+    return valor
+
+
+def ler_em_blocos(fonte, linhas_por_bloco=LINHAS_POR_BLOCO):
+    """
+    Gera DataFrames de até `linhas_por_bloco` linhas a partir de um DataFrame,
+    de um CSV (lido em blocos) ou de um Parquet (mapeado em memória, lido por lotes).
+    """
+    if isinstance(fonte, pd.DataFrame):
+        if fonte.empty:
+            yield fonte
+        for inicio in range(0, len(fonte), linhas_por_bloco):
+            yield fonte.iloc[inicio:inicio + linhas_por_bloco]
+        return
+
+    if str(fonte).lower().endswith(".parquet"):
+        import pyarrow.parquet as pq
+        arquivo = pq.ParquetFile(fonte, memory_map=True)
+        for lote in arquivo.iter_batches(batch_size=linhas_por_bloco):
+            yield lote.to_pandas()
+        return
+
+    with pd.read_csv(fonte, chunksize=linhas_por_bloco, encoding_errors="ignore") as leitor:
+        yield from leitor
+
+
+def calcular_estatisticas(fonte, linhas_por_bloco=LINHAS_POR_BLOCO):
+    """
+    Calcula estatísticas descritivas de um DataFrame, CSV ou Parquet, bloco a bloco.
+    Os tipos das colunas são definidos pelo primeiro bloco.
+    Retorna um dicionário serializável em JSON.
+    """
+    linhas = 0
+    # Chaveadas pela posição da coluna: planilhas podem repetir nomes de colunas
+    numericas, categoricas = {}, {}
+    nomes = []
+
+    for bloco in ler_em_blocos(fonte, linhas_por_bloco):
+        if linhas == 0 and not numericas and not categoricas:
+            nomes = _nomes_unicos(bloco.columns)
+            for posicao, tipo in enumerate(bloco.dtypes):
+                if pd.api.types.is_numeric_dtype(tipo) and not pd.api.types.is_bool_dtype(tipo):
+                    numericas[posicao] = EstatisticasNumericas()
+                elif pd.api.types.is_object_dtype(tipo) or isinstance(tipo, (pd.CategoricalDtype, pd.StringDtype)):
+                    categoricas[posicao] = EstatisticasCategoricas()
+        linhas += len(bloco)
+
+        if numericas:
+            valores = bloco.iloc[:, list(numericas)].apply(pd.to_numeric, errors="coerce")
+            matriz = valores.to_numpy(dtype=np.float64, na_value=np.nan)
+            for i, estatisticas in enumerate(numericas.values()):
+                estatisticas.adicionar(matriz[:, i])
+        for posicao, estatisticas in categoricas.items():
+            if posicao < bloco.shape[1]:
+                estatisticas.adicionar(bloco.iloc[:, posicao])
+
+    return {
+        "linhas": linhas,
+        "numericas": {nomes[p]: e.resultado() for p, e in numericas.items()},
+        "categoricas": {nomes[p]: e.resultado() for p, e in categoricas.items()},
+    }
+
+
+def _nomes_unicos(colunas):
+    """Nomes das colunas como texto; repetições recebem um sufixo com a posição (ex.: "a (2)")."""
+    nomes, vistos = [], set()
+    for posicao, coluna in enumerate(colunas):
+        nome = str(coluna)
+        if nome in vistos:
+            nome = f"{nome} ({posicao + 1})"
+        vistos.add(nome)
+        nomes.append(nome)
+    return nomes
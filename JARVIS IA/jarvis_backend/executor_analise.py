@@ -0,0 +1,385 @@
+# executor_analise.py
+# Executa o código Pandas gerado pela IA em processos separados, com limites de
+# CPU, memória e tempo, para que uma análise pesada não trave o servidor.
+# Cada job ocupa um processo de trabalho só seu: se o código for morto (limite de
+# CPU/memória ou tempo excedido), apenas esse processo é substituído e as análises
+# de outros utilizadores continuam a correr.
+#
+# Isolamento: os limites acima protegem o servidor, não os seus dados. O código gerado
+# tem os builtins completos, `os` e acesso à rede. Só com ANALISE_UID definido (servidor
+# iniciado como root) os processos de trabalho passam a correr com esse utilizador sem
+# privilégios e deixam de conseguir ler o .env, /proc/<pid>/environ do servidor e os
+# restantes arquivos do backend. Sem ANALISE_UID correm como o próprio servidor.
+
+import os
+import io
+import hashlib
+import pickle
+import shutil
+import asyncio
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from multiprocessing import get_all_start_methods, get_context, shared_memory
+
+import pandas as pd
+
+try:
+    import resource  # Disponível apenas em sistemas Unix
+except ImportError:
+    resource = None
+
+# --- Limites (configuráveis por variáveis de ambiente) ---
+NUM_PROCESSOS = int(os.getenv("ANALISE_NUM_PROCESSOS", "2"))
+LIMITE_CPU_SEGUNDOS = int(os.getenv("ANALISE_LIMITE_CPU_SEGUNDOS", "20"))
+LIMITE_MEMORIA_MB = int(os.getenv("ANALISE_LIMITE_MEMORIA_MB", "2048"))
+TIMEOUT_SEGUNDOS = float(os.getenv("ANALISE_TIMEOUT_SEGUNDOS", "30"))
+LIMITE_SAIDA_CARACTERES = 20000
+TAMANHO_CACHE_RESULTADOS = 256
+MAX_DATASETS = 8  # DataFrames mantidos em memória partilhada ao mesmo tempo
+# Utilizador/grupo sem privilégios para os processos de trabalho (ex.: 65534, "nobody")
+UID_WORKER = int(os.environ["ANALISE_UID"]) if os.getenv("ANALISE_UID") else None
+GID_WORKER = int(os.getenv("ANALISE_GID", UID_WORKER if UID_WORKER is not None else 0))
+
+# Variáveis de ambiente apagadas do processo de trabalho (não substitui ANALISE_UID:
+# sem ele, o ambiente do servidor continua legível em /proc)
+VARIAVEIS_SECRETAS = (
+    "OPENAI_API_KEY", "SERPER_API_KEY", "SUPABASE_URL", "SUPABASE_SERVICE_KEY",
+    "JWT_SECRET_KEY", "GMAIL_USER", "GMAIL_APP_PASSWORD",
+)
+MARCADORES_SECRETOS = ("KEY", "SECRET", "TOKEN", "PASSWORD", "SENHA")
+
+
+class CacheLRU:
+    """Dicionário com tamanho máximo que descarta o item usado há mais tempo."""
+
+    def __init__(self, tamanho_maximo):
+        self.tamanho_maximo = tamanho_maximo
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            if chave not in self._itens:
+                return None
+            self._itens.move_to_end(chave)
+            return self._itens[chave]
+
+    def set(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.tamanho_maximo:
+                self._itens.popitem(last=False)
+
+
+def hash_texto(texto: str):
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+def hash_dataframe(df):
+    """Calcula um hash estável do conteúdo do DataFrame (vetorizado pelo Pandas)."""
+    h = hashlib.sha256(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    h.update(repr(list(df.columns)).encode("utf-8"))
+    return h.hexdigest()
+
+
+# ==========================================================
+# === PARTILHA DO DATAFRAME SEM CÓPIA (SHARED MEMORY)
+# ==========================================================
+# O DataFrame é serializado com pickle protocolo 5: os arrays NumPy ficam fora
+# do pickle ("out-of-band") e são copiados uma única vez para memória partilhada.
+# Os processos de trabalho reconstroem o DataFrame apontando diretamente para
+# esses buffers, sem nova cópia.
+
+class DataFrameCompartilhado:
+    def __init__(self, df, dono=None):
+        buffers = []
+        cabecalho = pickle.dumps(df, protocol=5, buffer_callback=buffers.append)
+        views = [b.raw() for b in buffers]
+        tamanhos = [v.nbytes for v in views]
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, len(cabecalho) + sum(tamanhos)))
+        if dono is not None:
+            # O segmento é criado com modo 0600; o utilizador dos workers precisa de o abrir
+            os.fchown(self.shm._fd, *dono)
+        self.shm.buf[:len(cabecalho)] = cabecalho
+        posicao = len(cabecalho)
+        for view in views:
+            self.shm.buf[posicao:posicao + view.nbytes] = view
+            posicao += view.nbytes
+
+        # Descritor leve enviado aos processos de trabalho
+        self.descritor = (self.shm.name, len(cabecalho), tamanhos)
+
+    def liberar(self):
+        try:
+            self.shm.close()
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+# Cache de DataFrames já anexados, dentro de cada processo de trabalho
+_dataframes_do_worker = {}
+
+def _anexar_dataframe(descritor):
+    nome, tamanho_cabecalho, tamanhos = descritor
+    if nome in _dataframes_do_worker:
+        return _dataframes_do_worker[nome][1]
+
+    shm = shared_memory.SharedMemory(name=nome)
+    buffers = []
+    posicao = tamanho_cabecalho
+    for tamanho in tamanhos:
+        # Somente leitura: o código gerado não pode alterar os dados partilhados
+        buffers.append(shm.buf[posicao:posicao + tamanho].toreadonly())
+        posicao += tamanho
+    df = pickle.loads(shm.buf[:tamanho_cabecalho], buffers=buffers)
+    if len(_dataframes_do_worker) >= MAX_DATASETS:
+        # O mapeamento é fechado pelo coletor de lixo quando o DataFrame deixar de ser usado
+        _dataframes_do_worker.pop(next(iter(_dataframes_do_worker)))
+    _dataframes_do_worker[nome] = (shm, df)
+    return df
+
+
+# ==========================================================
+# === CÓDIGO EXECUTADO NOS PROCESSOS DE TRABALHO
+# ==========================================================
+
+def _remover_segredos():
+    """Apaga do ambiente do processo as chaves e senhas herdadas do servidor."""
+    for nome in list(os.environ):
+        if nome in VARIAVEIS_SECRETAS or any(marcador in nome.upper() for marcador in MARCADORES_SECRETOS):
+            del os.environ[nome]
+
+def _inicializar_worker(limite_memoria_mb, pasta_trabalho, uid, gid):
+    if uid is not None:
+        os.setgroups([])
+        os.setgid(gid)
+        os.setuid(uid)
+    # Pasta temporária própria, longe do diretório do backend (onde está o .env)
+    os.chdir(pasta_trabalho)
+    _remover_segredos()
+    if resource is not None and limite_memoria_mb:
+        limite = limite_memoria_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limite, limite))
+
+def _limitar_cpu(limite_segundos):
+    """Aplica o limite de CPU ao job atual (somado ao que o processo já consumiu)."""
+    if resource is None or not limite_segundos:
+        return
+    uso = resource.getrusage(resource.RUSAGE_SELF)
+    _, maximo = resource.getrlimit(resource.RLIMIT_CPU)
+    novo_limite = int(uso.ru_utime + uso.ru_stime) + limite_segundos
+    if maximo != resource.RLIM_INFINITY:
+        novo_limite = min(novo_limite, maximo)
+    resource.setrlimit(resource.RLIMIT_CPU, (novo_limite, maximo))
+
+def _executar_no_worker(codigo, descritor, limite_cpu_segundos):
+    import plotly.express as px
+
+    _limitar_cpu(limite_cpu_segundos)
+    try:
+        # Cópia rasa: colunas novas criadas pelo código não afetam o DataFrame em cache
+        df = _anexar_dataframe(descritor).copy(deep=False)
+    except (FileNotFoundError, PermissionError, ValueError) as e:
+        print(f"[DEBUG Análise] Falha ao anexar o dataset {descritor[0]}: {e}")
+        return {"type": "text", "content": "Erro na análise: os dados da planilha já não estão disponíveis, tente novamente."}
+    local_vars = {"df": df, "pd": pd, "px": px}
+
+    buffer = io.StringIO()
+    try:
+        with redirect_stdout(buffer):
+            exec(codigo, local_vars)
+    except MemoryError:
+        return {"type": "text", "content": "Erro na análise: limite de memória excedido."}
+    except Exception as e:
+        return {"type": "text", "content": f"Erro na análise: {e}"}
+
+    if "fig" in local_vars:
+        return {"type": "plot", "content": local_vars["fig"].to_json()}
+    return {"type": "text", "content": buffer.getvalue()[:LIMITE_SAIDA_CARACTERES]}
+
+def _ciclo_do_worker(conexao, limite_memoria_mb, pasta_trabalho, uid, gid):
+    """Laço do processo de trabalho: recebe um job pelo pipe, executa e devolve o resultado."""
+    _inicializar_worker(limite_memoria_mb, pasta_trabalho, uid, gid)
+    while True:
+        try:
+            pedido = conexao.recv()
+        except EOFError:
+            return
+        if pedido is None:
+            return
+        conexao.send(_executar_no_worker(*pedido))
+
+
+class _Worker:
+    """Um processo de trabalho e a ponta do pipe usada para falar com ele."""
+
+    def __init__(self, contexto, limite_memoria_mb, uid=None, gid=None):
+        self.pasta_trabalho = tempfile.mkdtemp(prefix="jarvis_analise_")
+        if uid is not None:
+            os.chown(self.pasta_trabalho, uid, gid)
+        self.conexao, conexao_filho = contexto.Pipe()
+        self.processo = contexto.Process(
+            target=_ciclo_do_worker, daemon=True,
+            args=(conexao_filho, limite_memoria_mb, self.pasta_trabalho, uid, gid),
+        )
+        self.processo.start()
+        conexao_filho.close()
+
+    def executar(self, pedido, timeout_segundos):
+        """Envia o job e espera o resultado; lança TimeoutError ou EOFError (processo morto)."""
+        self.conexao.send(pedido)
+        if not self.conexao.poll(timeout_segundos):
+            raise TimeoutError
+        return self.conexao.recv()
+
+    def encerrar(self):
+        self.processo.terminate()
+        self.processo.join(timeout=1)
+        self.conexao.close()
+        shutil.rmtree(self.pasta_trabalho, ignore_errors=True)
+
+
+# ==========================================================
+# === EXECUTOR (LADO DO SERVIDOR)
+# ==========================================================
+
+class ExecutorAnalise:
+    """
+    Processos de trabalho para o código de análise gerado pela IA, no máximo
+    `num_processos` jobs ao mesmo tempo. Os resultados ficam em cache pelo hash
+    do dataset + hash do código.
+    """
+
+    def __init__(self, num_processos=NUM_PROCESSOS, limite_cpu_segundos=LIMITE_CPU_SEGUNDOS,
+                 limite_memoria_mb=LIMITE_MEMORIA_MB, timeout_segundos=TIMEOUT_SEGUNDOS,
+                 uid=UID_WORKER, gid=GID_WORKER):
+        self.num_processos = num_processos
+        self.limite_cpu_segundos = limite_cpu_segundos
+        self.limite_memoria_mb = limite_memoria_mb
+        self.timeout_segundos = timeout_segundos
+        self.uid, self.gid = uid, gid
+        self._avisado = False
+        self.resultados = CacheLRU(TAMANHO_CACHE_RESULTADOS)
+        self._datasets = {}  # hash do dataset -> DataFrameCompartilhado
+        self._jobs_por_dataset = {}  # hash do dataset -> jobs em curso (não pode ser descartado)
+        self._livres = []    # Processos ociosos, reaproveitados entre jobs (DataFrames já anexados)
+        self._todos = set()
+        self._vagas = threading.BoundedSemaphore(num_processos)
+        self._lock = threading.Lock()
+        metodo = "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+        self._contexto = get_context(metodo)
+
+    def _reservar_worker(self):
+        """Bloqueia até haver uma vaga e devolve um processo ocioso (ou um novo)."""
+        self._vagas.acquire()
+        try:
+            with self._lock:
+                while self._livres:
+                    worker = self._livres.pop()
+                    if worker.processo.is_alive():
+                        return worker
+                    self._todos.discard(worker)
+            self._verificar_isolamento()
+            worker = _Worker(self._contexto, self.limite_memoria_mb, self.uid, self.gid)
+            with self._lock:
+                self._todos.add(worker)
+            return worker
+        except BaseException:
+            self._vagas.release()
+            raise
+
+    def _verificar_isolamento(self):
+        if self.uid is not None and os.geteuid() != 0:
+            raise PermissionError("ANALISE_UID exige que o servidor seja iniciado como root para trocar de utilizador.")
+        if self.uid is None and not self._avisado:
+            self._avisado = True
+            print("AVISO: ANALISE_UID não definido; o código de análise gerado corre com o utilizador do servidor, "
+                  "sem isolamento de arquivos nem de rede.")
+
+    def _devolver_worker(self, worker, saudavel):
+        with self._lock:
+            if saudavel:
+                self._livres.append(worker)
+            else:
+                self._todos.discard(worker)
+        if not saudavel:
+            # Apenas o processo deste job é encerrado; os outros jobs não são afetados
+            worker.encerrar()
+        self._vagas.release()
+
+    def _compartilhar(self, df, hash_df):
+        """Coloca `df` em memória partilhada e marca-o como em uso até `_soltar` ser chamado."""
+        with self._lock:
+            if hash_df not in self._datasets:
+                if len(self._datasets) >= MAX_DATASETS:
+                    # Descarta o mais antigo que não esteja a ser usado por nenhum job;
+                    # se todos estiverem em uso, o limite é excedido temporariamente
+                    livre = next((h for h in self._datasets if h not in self._jobs_por_dataset), None)
+                    if livre is not None:
+                        self._datasets.pop(livre).liberar()
+                dono = (self.uid, self.gid) if self.uid is not None else None
+                self._datasets[hash_df] = DataFrameCompartilhado(df, dono)
+            self._jobs_por_dataset[hash_df] = self._jobs_por_dataset.get(hash_df, 0) + 1
+            return self._datasets[hash_df].descritor
+
+    def _soltar(self, hash_df):
+        with self._lock:
+            restantes = self._jobs_por_dataset.pop(hash_df) - 1
+            if restantes:
+                self._jobs_por_dataset[hash_df] = restantes
+
+    def liberar_dataset(self, hash_df):
+        with self._lock:
+            dataset = self._datasets.pop(hash_df, None)
+        if dataset is not None:
+            dataset.liberar()
+
+    def executar(self, codigo, df, hash_df=None):
+        """Executa `codigo` com `df` num processo separado e devolve {"type", "content"}."""
+        hash_df = hash_df or hash_dataframe(df)
+        chave = (hash_df, hash_texto(codigo))
+        resultado = self.resultados.get(chave)
+        if resultado is not None:
+            print("[DEBUG Análise] Resultado encontrado no cache.")
+            return resultado
+
+        descritor = self._compartilhar(df, hash_df)
+        try:
+            worker = self._reservar_worker()
+            saudavel = False
+            try:
+                resultado = worker.executar((codigo, descritor, self.limite_cpu_segundos), self.timeout_segundos)
+                saudavel = True
+            except TimeoutError:
+                return {"type": "text", "content": f"Erro na análise: tempo limite de {self.timeout_segundos:.0f}s excedido."}
+            except (EOFError, OSError):
+                # O processo foi morto pelo sistema (limite de CPU ou de memória)
+                return {"type": "text", "content": "Erro na análise: limite de CPU ou memória excedido."}
+            finally:
+                self._devolver_worker(worker, saudavel)
+        finally:
+            self._soltar(hash_df)
+
+        if not resultado["content"].startswith("Erro na análise"):
+            self.resultados.set(chave, resultado)
+        return resultado
+
+    async def executar_async(self, codigo, df, hash_df=None):
+        """Versão assíncrona de `executar`, para não bloquear o event loop do FastAPI."""
+        return await asyncio.to_thread(self.executar, codigo, df, hash_df)
+
+    def encerrar(self):
+        with self._lock:
+            workers, self._todos, self._livres = list(self._todos), set(), []
+        for worker in workers:
+            worker.encerrar()
+        for hash_df in list(self._datasets):
+            self.liberar_dataset(hash_df)
+
+
+# Instância única usada por todo o backend
+executor_analise = ExecutorAnalise()
@@ -0,0 +1,162 @@
+# exportacao_pdf.py
+# Geração de PDFs de conversas. As fontes DejaVu são lidas e analisadas uma única
+# vez por processo; cada documento recebe apenas uma cópia leve delas.
+
+import io
+import os
+import re
+import copy
+import asyncio
+import zipfile
+import threading
+import unicodedata
+from urllib.parse import quote
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
+from fontTools import ttLib
+
+SCRIPT_DIR = os.path.dirname(__file__)
+FONTES = {
+    '': os.path.join(SCRIPT_DIR, 'assets', 'DejaVuSans.ttf'),
+    'B': os.path.join(SCRIPT_DIR, 'assets', 'DejaVuSans-Bold.ttf'),
+}
+FAMILIA_FONTE = 'DejaVu'
+FAMILIA_RESERVA = 'Helvetica'
+TAMANHO_BLOCO_STREAM = 64 * 1024
+
+_fontes_base = None  # estilo -> (TTFFont já analisada, bytes do arquivo .ttf)
+_lock_fontes = threading.Lock()
+
+
+def _carregar_fontes_base():
+    """Analisa os arquivos .ttf uma vez e guarda o resultado para os próximos documentos."""
+    global _fontes_base
+    with _lock_fontes:
+        if _fontes_base is None:
+            try:
+                modelo = FPDF()
+                fontes = {}
+                for estilo, caminho in FONTES.items():
+                    modelo.add_font(FAMILIA_FONTE, estilo, caminho)
+                    with open(caminho, 'rb') as f:
+                        fontes[estilo] = (modelo.fonts[f"{FAMILIA_FONTE.lower()}{estilo}"], f.read())
+                _fontes_base = fontes
+            except Exception as e:
+                print(f"AVISO: Não foi possível carregar as fontes DejaVu, a usar {FAMILIA_RESERVA}: {e}")
+                _fontes_base = {}
+        return _fontes_base
+
+def novo_documento():
+    """
+    Cria um FPDF com as fontes DejaVu já registadas, a partir do cache do processo.
+    Retorna (pdf, familia_de_fonte).
+    """
+    pdf = FPDF()
+    fontes = _carregar_fontes_base()
+    if not fontes:
+        return pdf, FAMILIA_RESERVA
+
+    for estilo, (fonte_base, dados_ttf) in fontes.items():
+        # O deepcopy do fpdf2 partilha alguns atributos com a fonte em cache; os que o
+        # output() altera são substituídos por instâncias próprias de cada documento:
+        # - o objeto do fontTools, onde o subconjunto da fonte é gravado (lido da memória);
+        # - o descritor da fonte, que recebe o id do objeto PDF, o nome e o arquivo embutido;
+        # - a fonte HarfBuzz, criada sob demanda a partir do objeto do fontTools.
+        # O cmap e as métricas são só lidos e continuam partilhados.
+        fonte = copy.deepcopy(fonte_base)
+        fonte.ttfont = ttLib.TTFont(io.BytesIO(dados_ttf), recalcTimestamp=False, lazy=True)
+        fonte.desc = copy.copy(fonte_base.desc)
+        fonte._hbfont = None
+        fonte.i = len(pdf.fonts) + 1
+        pdf.fonts[fonte.fontkey] = fonte
+    return pdf, FAMILIA_FONTE
+
+
+def _escrever_titulo(pdf, familia, titulo):
+    pdf.set_font(familia, 'B', 18)
+    pdf.multi_cell(0, 10, titulo, new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
+    pdf.ln(15)
+
+def _texto_seguro(texto, familia):
+    # As fontes padrão (Helvetica) só aceitam latin-1
+    if familia == FAMILIA_RESERVA:
+        return texto.encode('latin-1', errors='replace').decode('latin-1')
+    return texto
+
+def renderizar_texto(texto_corpo, titulo_documento):
+    """Gera um PDF com um título e um texto corrido. Retorna os bytes do documento."""
+    pdf, familia = novo_documento()
+    pdf.add_page()
+    _escrever_titulo(pdf, familia, _texto_seguro(titulo_documento, familia))
+    pdf.set_font(familia, '', 11)
+    pdf.multi_cell(0, 7, _texto_seguro(texto_corpo, familia), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    return bytes(pdf.output())
+
+def renderizar_conversa(titulo, mensagens):
+    """Gera o PDF de uma conversa (lista de {"role", "content"}). Retorna os bytes do documento."""
+    pdf, familia = novo_documento()
+    pdf.add_page()
+    _escrever_titulo(pdf, familia, _texto_seguro(titulo or "Conversa", familia))
+    for mensagem in mensagens:
+        autor = "Você" if mensagem.get("role") == "user" else "Jarvis"
+        pdf.set_font(familia, 'B', 12)
+        pdf.multi_cell(0, 8, _texto_seguro(autor, familia), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.set_font(familia, '', 11)
+        pdf.multi_cell(0, 7, _texto_seguro(str(mensagem.get("content", "")), familia), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.ln(4)
+    return bytes(pdf.output())
+
+
+def nome_arquivo_pdf(titulo, indice=None):
+    base = re.sub(r'[^\w\- ]+', '', titulo or '').strip().replace(' ', '_')[:60] or 'conversa'
+    return f"{indice:03d}_{base}.pdf" if indice is not None else f"{base}.pdf"
+
+def content_disposition(nome_arquivo):
+    """
+    Cabeçalho Content-Disposition para download. Os cabeçalhos HTTP só aceitam Latin-1,
+    por isso vai um nome ASCII de reserva e o nome original em `filename*` (RFC 5987).
+    """
+    base, extensao = os.path.splitext(nome_arquivo)
+    base_ascii = unicodedata.normalize('NFKD', base).encode('ascii', 'ignore').decode('ascii')
+    nome_ascii = (re.sub(r'[^\w\-]+', '_', base_ascii).strip('_') or 'download') + extensao
+    return f"attachment; filename=\"{nome_ascii}\"; filename*=UTF-8''{quote(nome_arquivo, safe='')}"
+
+
+class _BufferZip(io.RawIOBase):
+    """Destino não-pesquisável para o ZipFile: acumula bytes até serem enviados ao cliente."""
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def retirar(self):
+        dados = b"".join(self._partes)
+        self._partes = []
+        return dados
+
+
+async def stream_pdf_conversa(titulo, mensagens):
+    """Gera o PDF fora do event loop e envia-o ao cliente em blocos."""
+    documento = await asyncio.to_thread(renderizar_conversa, titulo, mensagens)
+    for inicio in range(0, len(documento), TAMANHO_BLOCO_STREAM):
+        yield documento[inicio:inicio + TAMANHO_BLOCO_STREAM]
+
+async def stream_zip_conversas(conversas):
+    """
+    Gera um .zip com um PDF por conversa. Cada PDF é renderizado numa thread e
+    enviado assim que fica pronto, sem montar o arquivo .zip inteiro na memória.
+    """
+    buffer = _BufferZip()
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED) as arquivo_zip:
+        for indice, conversa in enumerate(conversas, start=1):
+            documento = await asyncio.to_thread(renderizar_conversa, conversa.titulo, conversa.mensagens)
+            # Os PDFs já vêm comprimidos; ZIP_STORED evita gastar CPU a comprimir de novo
+            arquivo_zip.writestr(nome_arquivo_pdf(conversa.titulo, indice), documento)
+            yield buffer.retirar()
+    yield buffer.retirar()  # Diretório central do .zip, escrito ao fechar
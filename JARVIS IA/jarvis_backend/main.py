@@ -8,7 +8,7 @@ import os
 from fastapi import UploadFile, File
 import uuid
 import utils
-from context_cache import file_contexts
+from context_cache import guardar_contexto
 # <--- FIM DA ADIÇÃO --->
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
@@ -23,9 +23,18 @@ from passlib.context import CryptContext
 from jose import jwt, JWTError
 from dotenv import load_dotenv
 # Módulos do projeto e conexões
-from supabase import create_client, Client
-from config import openai_client, supabase, SECRET_KEY, ALGORITHM
+from config import openai_client, SECRET_KEY, ALGORITHM, SUPABASE_URL, SUPABASE_KEY, MEMORIA_ATIVA
+from repositorio import (
+    RepositorioSupabase, definir_repositorio, obter_repositorio,
+    iniciar_memo_do_pedido, encerrar_memo_do_pedido
+)
 import core_logic
+from executor_analise import executor_analise
+import exportacao_pdf
+from especulacao import metricas_especulacao
+from montagem_prompt import metricas_cache_prompt
+from medicao_uso import medidor_uso, usuario_atual, consultar_uso_por_usuario
+from memoria_longo_prazo import obter_modelo, apagar_memoria
 
 # Carrega as variáveis de ambiente do arquivo .env
 load_dotenv()
@@ -71,6 +80,13 @@ class TitleGenerationInput(BaseModel):
 
 class TitleGenerationOutput(BaseModel):
     title: str
+
+class ConversaExport(BaseModel):
+    titulo: str = "Conversa"
+    mensagens: list
+
+class ExportPdfInput(BaseModel):
+    conversas: List[ConversaExport]
     
 # ==========================================================
 # === INICIALIZAÇÃO DA APLICAÇÃO
@@ -94,6 +110,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def memo_por_pedido(request, call_next):
+    # Consultas idênticas ao Supabase dentro do mesmo pedido são feitas uma só vez
+    token_memo = iniciar_memo_do_pedido()
+    try:
+        return await call_next(request)
+    finally:
+        encerrar_memo_do_pedido(token_memo)
+
+@app.on_event("startup")
+async def iniciar_servicos():
+    # Cliente assíncrono do Supabase, com conexões reaproveitadas entre pedidos
+    definir_repositorio(await RepositorioSupabase.criar(SUPABASE_URL, SUPABASE_KEY))
+    # Envio periódico (em lote) do uso de tokens para o Supabase
+    app.state.tarefa_uso = asyncio.create_task(medidor_uso.executar_periodicamente())
+    if MEMORIA_ATIVA:
+        # Carrega o modelo de embeddings em segundo plano, para o primeiro chat não esperar por ele
+        app.state.tarefa_modelo_memoria = asyncio.create_task(asyncio.to_thread(obter_modelo))
+
+@app.on_event("shutdown")
+async def encerrar_servicos():
+    # Encerra os processos de análise e libera a memória partilhada dos DataFrames
+    executor_analise.encerrar()
+    # Envia o que ainda estiver em memória; se falhar, fica no spool para o próximo arranque
+    app.state.tarefa_uso.cancel()
+    await medidor_uso.enviar()
+    await obter_repositorio().fechar()
+
 # ==========================================================
 # === FUNÇÕES DE DEPENDÊNCIA E SEGURANÇA
 # ==========================================================
@@ -121,12 +165,10 @@ async def get_current_active_user(token: str = Depends(oauth2_scheme)):
         raise credentials_exception
 
     # Agora, buscamos o usuário no banco de dados a cada requisição
-    response = supabase.table('usuarios').select("email, role, data_expiracao").eq('email', email).execute()
+    user = await obter_repositorio().buscar_usuario(email)
     
-    if not response.data:
+    if not user:
         raise credentials_exception
-        
-    user = response.data[0]
 
     # E verificamos a expiração em tempo real
     if user.get("data_expiracao"):
@@ -155,11 +197,9 @@ async def health_check():
 
 @app.post("/api/auth/login", response_model=Token)
 async def login_for_access_token(form_data: UserLogin):
-    response = supabase.table('usuarios').select("email, senha_hash, role, data_expiracao").eq('email', form_data.email).execute()
-    if not response.data:
+    user = await obter_repositorio().buscar_credenciais(form_data.email)
+    if not user:
         raise HTTPException(status_code=401, detail="E-mail ou senha incorretos")
-    
-    user = response.data[0]
 
     # --- VERIFICAÇÃO DE EXPIRAÇÃO ---
     if user.get("data_expiracao"):
@@ -179,8 +219,7 @@ async def login_for_access_token(form_data: UserLogin):
 # ==========================================================
 @app.get("/api/admin/users")
 async def get_all_users(admin_user: dict = Depends(get_current_admin_user)):
-    response = supabase.table('usuarios').select("nome, email, role, data_expiracao").execute()
-    return response.data
+    return await obter_repositorio().listar_usuarios()
 
 @app.post("/api/admin/users")
 async def create_user_subscription(user: UserCreate, admin_user: dict = Depends(get_current_admin_user)):
@@ -190,14 +229,14 @@ async def create_user_subscription(user: UserCreate, admin_user: dict = Depends(
     else:
         expiracao = datetime.now(timezone.utc) + timedelta(days=user.dias_duracao)
     
-    response = supabase.table('usuarios').insert({
+    dados = await obter_repositorio().criar_usuario({
         "nome": user.name, "email": user.email, "senha_hash": hashed_password, 
         "role": "user", "data_expiracao": expiracao.isoformat()
-    }).execute()
+    })
     
-    if "unique constraint" in str(response.data):
+    if "unique constraint" in str(dados):
          raise HTTPException(status_code=400, detail="E-mail já registrado.")
-    if not response.data:
+    if not dados:
         raise HTTPException(status_code=400, detail="E-mail já pode estar em uso ou outro erro ocorreu.")
     return {"message": f"Usuário {user.name} criado com sucesso."}
 
@@ -212,56 +251,69 @@ async def update_user(email: str, user_update: UserUpdate, admin_user: dict = De
         update_data['data_expiracao'] = update_data['data_expiracao'].isoformat()
     # ==========================================
 
-    response = supabase.table('usuarios').update(update_data).eq('email', email).execute()
+    dados = await obter_repositorio().atualizar_usuario(email, update_data)
 
-    if not response.data:
+    if not dados:
         raise HTTPException(status_code=404, detail="Usuário não encontrado.")
     return {"message": f"Usuário {email} atualizado com sucesso."}
 
 @app.delete("/api/admin/users/{email}")
 async def delete_user(email: str, admin_user: dict = Depends(get_current_admin_user)):
+    # Utilizador e preferências são excluídos numa única transação (RPC excluir_usuario)
+    excluido = await obter_repositorio().excluir_usuario(email)
     
-    supabase.table('preferencias').delete().eq('user_email', email).execute()
-
-    
-    response = supabase.table('usuarios').delete().eq('email', email).execute()
-    
-    if not response.data:
+    if not excluido:
         raise HTTPException(status_code=404, detail="Usuário não encontrado.")
+    # Factos pessoais extraídos das conversas (memória de longo prazo) também são apagados
+    await asyncio.to_thread(apagar_memoria, email)
     return {"message": f"Usuário {email} e todas as suas preferências foram excluídos com sucesso."}
         
+@app.get("/api/admin/usage")
+async def get_token_usage(dias: int = 30, admin_user: dict = Depends(get_current_admin_user)):
+    # Totais por utilizador a partir da tabela agregada uso_tokens (não dos eventos brutos)
+    return await consultar_uso_por_usuario(dias)
+
+@app.get("/api/admin/metrics/speculation")
+async def get_speculation_metrics(admin_user: dict = Depends(get_current_admin_user)):
+    # Ganho de tempo até o primeiro token e tokens desperdiçados pelo modo especulativo
+    return metricas_especulacao.resumo()
+
+@app.get("/api/admin/metrics/prompt-cache")
+async def get_prompt_cache_metrics(admin_user: dict = Depends(get_current_admin_user)):
+    # Proporção de tokens de entrada servidos pelo cache de prefixo da OpenAI
+    return metricas_cache_prompt.resumo()
+
 # ==========================================================
 # === ENDPOINTS DE PREFERÊNCIAS
 # ==========================================================
 @app.get("/api/preferences")
 async def get_user_preferences(current_user: dict = Depends(get_current_active_user)):
     user_email = current_user['email']
-    response = supabase.table('preferencias').select('id, topico, valor').eq('user_email', user_email).execute()
-    return response.data
+    return await obter_repositorio().listar_preferencias(user_email)
 
 @app.post("/api/preferences")
 async def create_user_preference(preferencia: PreferenciaCreate, current_user: dict = Depends(get_current_active_user)):
     user_email = current_user['email']
-    response = supabase.table('preferencias').insert({
-        "user_email": user_email, "topico": preferencia.topico.strip().lower(), "valor": preferencia.valor.strip()
-    }).execute()
-    if "unique constraint" in str(response.data):
+    dados = await obter_repositorio().criar_preferencia(
+        user_email, preferencia.topico.strip().lower(), preferencia.valor.strip()
+    )
+    if "unique constraint" in str(dados) or not dados:
         raise HTTPException(status_code=400, detail="Este tópico de preferência já existe.")
-    return response.data[0]
+    return dados[0]
 
 @app.put("/api/preferences/{pref_id}")
 async def update_user_preference(pref_id: int, preferencia: PreferenciaUpdate, current_user: dict = Depends(get_current_active_user)):
     user_email = current_user['email']
-    response = supabase.table('preferencias').update({"valor": preferencia.valor}).eq('id', pref_id).eq('user_email', user_email).execute()
-    if not response.data:
+    dados = await obter_repositorio().atualizar_preferencia(pref_id, user_email, preferencia.valor)
+    if not dados:
         raise HTTPException(status_code=404, detail="Preferência não encontrada ou não pertence ao usuário.")
-    return response.data[0]
+    return dados[0]
 
 @app.delete("/api/preferences/{pref_id}")
 async def delete_user_preference(pref_id: int, current_user: dict = Depends(get_current_active_user)):
     user_email = current_user['email']
-    response = supabase.table('preferencias').delete().eq('id', pref_id).eq('user_email', user_email).execute()
-    if not response.data:
+    dados = await obter_repositorio().excluir_preferencia(pref_id, user_email)
+    if not dados:
         raise HTTPException(status_code=404, detail="Preferência não encontrada ou não pertence ao usuário.")
     return {"ok": True}
 
@@ -276,17 +328,18 @@ async def handle_file_upload(
 ):
     conteudo_agregado = []
     nomes_arquivos = []
+    tabelas = {}
 
     for file in files:
         nomes_arquivos.append(file.filename)
-        texto_extraido = await utils.extrair_texto_de_upload(file)
+        texto_extraido = await utils.extrair_texto_de_upload(file, tabelas)
         conteudo_agregado.append(
             f"--- INÍCIO DO ARQUIVO: {file.filename} ---\n\n{texto_extraido}\n\n--- FIM DO ARQUIVO: {file.filename} ---"
         )
     
     contexto_final = "\n\n".join(conteudo_agregado)
     context_id = str(uuid.uuid4())
-    file_contexts[context_id] = contexto_final # Armazena em memória
+    guardar_contexto(context_id, contexto_final, tabelas) # Armazena em memória (com limite)
 
     return {"context_id": context_id, "filenames": nomes_arquivos}
 
@@ -298,10 +351,31 @@ async def handle_chat_stream(message: str, history: str, token: str, context_id:
     )
 
 @app.post("/chat/generate-title", response_model=TitleGenerationOutput)
-async def handle_generate_title(payload: TitleGenerationInput):
+async def handle_generate_title(payload: TitleGenerationInput, current_user: dict = Depends(get_current_active_user)):
+    usuario_atual.set(current_user['email'])
     titulo = core_logic.gerar_titulo_conversa(payload.history)
     return TitleGenerationOutput(title=titulo)
 
+@app.post("/chat/export-pdf")
+async def handle_export_pdf(payload: ExportPdfInput, current_user: dict = Depends(get_current_active_user)):
+    if not payload.conversas:
+        raise HTTPException(status_code=400, detail="Nenhuma conversa fornecida para exportação.")
+
+    if len(payload.conversas) == 1:
+        conversa = payload.conversas[0]
+        nome_arquivo = exportacao_pdf.nome_arquivo_pdf(conversa.titulo)
+        return StreamingResponse(
+            exportacao_pdf.stream_pdf_conversa(conversa.titulo, conversa.mensagens),
+            media_type="application/pdf",
+            headers={"Content-Disposition": exportacao_pdf.content_disposition(nome_arquivo)}
+        )
+
+    return StreamingResponse(
+        exportacao_pdf.stream_zip_conversas(payload.conversas),
+        media_type="application/zip",
+        headers={"Content-Disposition": exportacao_pdf.content_disposition("conversas_jarvis.zip")}
+    )
+
 # ==========================================================
 # === Bloco para iniciar o servidor
 # ==========================================================
@@ -0,0 +1,139 @@
+# medicao_uso.py
+# Medição do consumo de tokens por utilizador e modelo.
+# Cada chamada à OpenAI só soma o `usage` num agregado em memória; de tempos em
+# tempos os agregados são gravados num arquivo local (spool) e enviados ao Supabase
+# num único RPC por lote. Um lote só sai do spool depois de confirmado, e o RPC
+# ignora lotes já aplicados, por isso uma falha de rede não perde nem duplica dados.
+# O SQL da tabela e do RPC está em sql/uso_tokens.sql.
+
+import os
+import json
+import uuid
+import asyncio
+import threading
+import contextvars
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
+from repositorio import obter_repositorio
+
+INTERVALO_ENVIO_SEGUNDOS = int(os.getenv("USO_INTERVALO_ENVIO_SEGUNDOS", "30"))
+CAMINHO_SPOOL = os.getenv("USO_CAMINHO_SPOOL", os.path.join(os.path.dirname(__file__), "uso_tokens_spool.jsonl"))
+
+# Utilizador do pedido atual; é copiado automaticamente para asyncio.to_thread
+usuario_atual = contextvars.ContextVar("usuario_atual", default=None)
+
+
+class MedidorUso:
+    def __init__(self, caminho_spool=CAMINHO_SPOOL, intervalo_segundos=INTERVALO_ENVIO_SEGUNDOS):
+        self.caminho_spool = caminho_spool
+        self.intervalo_segundos = intervalo_segundos
+        self._agregados = {}  # (email, modelo, dia) -> contadores
+        self._lock = threading.Lock()
+        self._lock_envio = asyncio.Lock()
+
+    def registrar(self, usage, modelo, email=None):
+        """Soma o `usage` de uma resposta da OpenAI (normal ou o último pedaço de um stream)."""
+        if usage is None:
+            return
+        email = email or usuario_atual.get() or "anonimo"
+        dia = datetime.now(timezone.utc).date().isoformat()
+        detalhes = getattr(usage, "prompt_tokens_details", None)
+        with self._lock:
+            contadores = self._agregados.setdefault(
+                (email, modelo, dia),
+                {"chamadas": 0, "tokens_entrada": 0, "tokens_saida": 0, "tokens_em_cache": 0}
+            )
+            contadores["chamadas"] += 1
+            contadores["tokens_entrada"] += usage.prompt_tokens or 0
+            contadores["tokens_saida"] += usage.completion_tokens or 0
+            contadores["tokens_em_cache"] += getattr(detalhes, "cached_tokens", 0) or 0
+
+    def registrar_estimativa(self, tokens_entrada, tokens_saida, modelo, email=None):
+        """Para streams interrompidos antes do `usage` chegar: a OpenAI cobra-os na mesma."""
+        usage = SimpleNamespace(prompt_tokens=tokens_entrada, completion_tokens=tokens_saida, prompt_tokens_details=None)
+        self.registrar(usage, modelo, email)
+
+    def _gravar_no_spool(self):
+        """Move os agregados da memória para um novo lote no arquivo de spool."""
+        with self._lock:
+            agregados, self._agregados = self._agregados, {}
+        if not agregados:
+            return
+        lote = {
+            "lote_id": str(uuid.uuid4()),
+            "linhas": [
+                {"user_email": email, "modelo": modelo, "dia": dia, **contadores}
+                for (email, modelo, dia), contadores in agregados.items()
+            ],
+        }
+        with open(self.caminho_spool, "a", encoding="utf-8") as f:
+            f.write(json.dumps(lote, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _ler_spool(self):
+        try:
+            with open(self.caminho_spool, "r", encoding="utf-8") as f:
+                return [json.loads(linha) for linha in f if linha.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _reescrever_spool(self, lotes):
+        temporario = self.caminho_spool + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            for lote in lotes:
+                f.write(json.dumps(lote, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, self.caminho_spool)
+
+    async def enviar(self):
+        """Grava os agregados no spool e envia ao Supabase todos os lotes pendentes."""
+        async with self._lock_envio:
+            # Leitura/escrita do spool (com fsync) fica fora do event loop; só o RPC é aguardado nele
+            await asyncio.to_thread(self._gravar_no_spool)
+            pendentes = await asyncio.to_thread(self._ler_spool)
+            if not pendentes:
+                return
+            enviados = 0
+            for lote in pendentes:
+                try:
+                    await obter_repositorio().registrar_uso_tokens(lote["lote_id"], lote["linhas"])
+                except Exception as e:
+                    print(f"[ERRO Uso] Falha ao enviar lote de uso de tokens; nova tentativa no próximo ciclo: {e}")
+                    break
+                enviados += 1
+            await asyncio.to_thread(self._reescrever_spool, pendentes[enviados:])
+            if enviados:
+                print(f"[DEBUG Uso] {enviados} lote(s) de uso de tokens enviados ao Supabase.")
+
+    async def executar_periodicamente(self):
+        """Tarefa de fundo do FastAPI: envia os agregados a cada `intervalo_segundos`."""
+        while True:
+            await asyncio.sleep(self.intervalo_segundos)
+            try:
+                await self.enviar()
+            except Exception as e:
+                print(f"[ERRO Uso] Falha no envio periódico do uso de tokens: {e}")
+
+
+# Instância única usada por todo o backend
+medidor_uso = MedidorUso()
+
+
+async def consultar_uso_por_usuario(dias: int = 30):
+    """Totais de uso por utilizador (e por modelo) nos últimos `dias`; a soma por dia é feita no banco."""
+    desde = (datetime.now(timezone.utc).date() - timedelta(days=dias - 1)).isoformat()
+    linhas = await obter_repositorio().listar_uso_tokens(desde)
+
+    totais = {}
+    for linha in linhas:
+        usuario = totais.setdefault(linha['user_email'], {
+            "user_email": linha['user_email'], "chamadas": 0, "tokens_entrada": 0,
+            "tokens_saida": 0, "tokens_em_cache": 0, "por_modelo": {}
+        })
+        modelo = usuario["por_modelo"].setdefault(linha['modelo'], {"chamadas": 0, "tokens_entrada": 0, "tokens_saida": 0, "tokens_em_cache": 0})
+        for campo in ("chamadas", "tokens_entrada", "tokens_saida", "tokens_em_cache"):
+            usuario[campo] += linha[campo]
+            modelo[campo] += linha[campo]
+    return list(totais.values())
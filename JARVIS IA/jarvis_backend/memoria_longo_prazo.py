@@ -0,0 +1,398 @@
+# memoria_longo_prazo.py
+# Memória de longo prazo por utilizador: factos duradouros extraídos das conversas
+# ("é vegetariano", "trabalha com Python"), guardados com o seu embedding num índice
+# vetorial em disco. A cada turno só os factos mais relevantes vão para o prompt,
+# por isso o tamanho do prompt não cresce com o histórico do utilizador.
+#
+# Estrutura em disco (uma pasta por utilizador):
+#   vetores-<versão>.npy  - matriz float32 (capacidade x dimensão), aberta com np.memmap
+#   fatos-<versão>.jsonl  - um facto por linha, na mesma ordem das linhas dos vetores
+#   indice-<versão>.npz   - centróides e limites das listas do índice IVF
+#   meta.json             - versão atual, número de factos, dimensão e quantos estão indexados
+# A reindexação grava uma versão nova dos três arquivos e só depois troca meta.json,
+# por isso uma interrupção a meio deixa a versão anterior intacta.
+#
+# As primeiras `n_indexados` linhas estão ordenadas por lista (cluster), de modo
+# que cada lista é uma fatia contígua do arquivo; as restantes ("cauda") são
+# procuradas por força bruta até à próxima reindexação.
+
+import os
+import re
+import json
+import asyncio
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from config import openai_client
+from medicao_uso import medidor_uso
+
+DIRETORIO_MEMORIA = os.getenv("MEMORIA_DIR", os.path.join(os.path.dirname(__file__), "memoria_usuarios"))
+MODELO_EMBEDDINGS = os.getenv("MEMORIA_MODELO_EMBEDDINGS", "paraphrase-multilingual-MiniLM-L12-v2")
+
+TOP_K = 5                  # Factos por turno no prompt
+LIMIAR_RELEVANCIA = 0.35   # Similaridade mínima para um facto ir para o prompt
+LIMIAR_DUPLICADO = 0.92    # Acima disto, o facto novo é considerado repetido
+MIN_FATOS_INDICE = 4096    # Abaixo disto a busca exata já é rápida o suficiente
+MIN_SONDAS = 8             # Listas do IVF visitadas por consulta (no mínimo)
+VETORES_POR_CONSULTA = 2048  # Quantos vetores indexados cada consulta lê, aproximadamente
+MAX_CAUDA = 1024           # Factos fora do índice antes de reindexar
+CAPACIDADE_INICIAL = 256
+MAX_INDICES_ABERTOS = 64
+
+_ARQUIVO_VERSIONADO = re.compile(r"^(vetores|fatos|indice)-(\d+)\.")
+
+
+# ==========================================================
+# === EMBEDDINGS
+# ==========================================================
+
+_modelo = None
+_erro_modelo = None  # Falha ao carregar: não se volta a tentar (nem a descarregar) a cada mensagem
+_lock_modelo = threading.Lock()
+
+def obter_modelo():
+    """Carrega o modelo sentence-transformers uma única vez por processo."""
+    global _modelo, _erro_modelo
+    with _lock_modelo:
+        if _erro_modelo is not None:
+            raise RuntimeError(f"Modelo de embeddings indisponível: {_erro_modelo}")
+        if _modelo is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+                print(f"INFO: A carregar o modelo de embeddings '{MODELO_EMBEDDINGS}'...")
+                _modelo = SentenceTransformer(MODELO_EMBEDDINGS)
+            except Exception as e:
+                _erro_modelo = e
+                raise
+        return _modelo
+
+def embutir(textos):
+    """Embeddings normalizados (float32), um por linha; o produto interno é a similaridade de cosseno."""
+    vetores = obter_modelo().encode(textos, normalize_embeddings=True, convert_to_numpy=True)
+    return np.asarray(vetores, dtype=np.float32).reshape(len(textos), -1)
+
+
+# ==========================================================
+# === ÍNDICE VETORIAL POR UTILIZADOR
+# ==========================================================
+
+class IndiceVetorialUsuario:
+    def __init__(self, pasta, lock=None):
+        self.pasta = pasta
+        # Partilhado por todas as instâncias da mesma pasta (ver obter_indice)
+        self.lock = lock or threading.RLock()
+        with self.lock:
+            self._carregar()
+
+    # --- Persistência ---
+
+    def _carregar(self):
+        meta = self._ler_json("meta.json") or {"n": 0, "dim": None, "n_indexados": 0, "versao": 0}
+        self.n, self.dim, self.n_indexados = meta["n"], meta["dim"], meta["n_indexados"]
+        self.versao = meta.get("versao", 0)
+        self.fatos = self._ler_fatos()
+        self.vetores = None
+        if self.dim is not None:
+            self.vetores = np.load(self._arquivo("vetores.npy"), mmap_mode="r+")
+        self.centroides, self.limites = None, None
+        if os.path.exists(self._arquivo("indice.npz")):
+            with np.load(self._arquivo("indice.npz")) as indice:
+                self.centroides, self.limites = indice["centroides"], indice["limites"]
+        if os.path.isdir(self.pasta):
+            self._apagar_outras_versoes()
+
+    def _sincronizar(self):
+        """Recarrega o estado se outra instância da mesma pasta o alterou entretanto."""
+        meta = self._ler_json("meta.json") or {"n": 0, "versao": 0}
+        if (meta["n"], meta.get("versao", 0)) != (self.n, self.versao):
+            self._carregar()
+
+    def _caminho(self, nome):
+        return os.path.join(self.pasta, nome)
+
+    def _arquivo(self, nome, versao=None):
+        """Caminho de um dos arquivos de dados na versão indicada (por omissão, a atual)."""
+        base, extensao = os.path.splitext(nome)
+        return self._caminho(f"{base}-{self.versao if versao is None else versao}{extensao}")
+
+    def _apagar_outras_versoes(self):
+        """Remove arquivos de versões anteriores ou de uma reindexação interrompida."""
+        for nome in os.listdir(self.pasta):
+            encontrado = _ARQUIVO_VERSIONADO.match(nome)
+            if (encontrado and int(encontrado.group(2)) != self.versao) or ".tmp" in nome:
+                os.remove(self._caminho(nome))
+
+    def _ler_json(self, nome):
+        try:
+            with open(self._caminho(nome), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _ler_fatos(self):
+        try:
+            with open(self._arquivo("fatos.jsonl"), "r", encoding="utf-8") as f:
+                fatos = [json.loads(linha) for linha in f if linha.strip()]
+        except FileNotFoundError:
+            return []
+        if len(fatos) > self.n:
+            # Escrita interrompida antes de meta.json: descarta o que não chegou a ser confirmado
+            fatos = fatos[:self.n]
+            self._gravar_fatos(fatos, self._arquivo("fatos.jsonl"))
+        return fatos
+
+    def _gravar_fatos(self, fatos, caminho):
+        temporario = caminho + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            for texto in fatos:
+                f.write(json.dumps(texto, ensure_ascii=False) + "\n")
+        os.replace(temporario, caminho)
+
+    def _gravar_meta(self):
+        temporario = self._caminho("meta.json.tmp")
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump({"n": self.n, "dim": self.dim, "n_indexados": self.n_indexados, "versao": self.versao}, f)
+        os.replace(temporario, self._caminho("meta.json"))
+
+    def _garantir_capacidade(self, total):
+        capacidade = 0 if self.vetores is None else self.vetores.shape[0]
+        if total <= capacidade:
+            return
+        nova_capacidade = max(CAPACIDADE_INICIAL, capacidade * 2, total)
+        temporario = self._caminho("vetores.tmp.npy")
+        novos = np.lib.format.open_memmap(temporario, mode="w+", dtype=np.float32, shape=(nova_capacidade, self.dim))
+        if self.n:
+            novos[:self.n] = self.vetores[:self.n]
+        novos.flush()
+        del novos
+        self.vetores = None
+        os.replace(temporario, self._arquivo("vetores.npy"))
+        self.vetores = np.load(self._arquivo("vetores.npy"), mmap_mode="r+")
+
+    # --- Escrita ---
+
+    def adicionar(self, textos, vetores):
+        """Guarda os factos que ainda não existem. Retorna quantos foram adicionados."""
+        with self.lock:
+            self._sincronizar()
+            if self.dim is None:
+                os.makedirs(self.pasta, exist_ok=True)
+                self.dim = vetores.shape[1]
+            novos_textos, novos_vetores = [], []
+            for texto, vetor in zip(textos, vetores):
+                repetido = self.n and self._buscar(vetor, 1, LIMIAR_DUPLICADO)
+                repetido = repetido or any(float(v @ vetor) >= LIMIAR_DUPLICADO for v in novos_vetores)
+                if not repetido:
+                    novos_textos.append(texto)
+                    novos_vetores.append(vetor)
+            if not novos_textos:
+                return 0
+
+            self._garantir_capacidade(self.n + len(novos_textos))
+            self.vetores[self.n:self.n + len(novos_textos)] = np.stack(novos_vetores)
+            self.vetores.flush()
+            with open(self._arquivo("fatos.jsonl"), "a", encoding="utf-8") as f:
+                for texto in novos_textos:
+                    f.write(json.dumps(texto, ensure_ascii=False) + "\n")
+            self.fatos.extend(novos_textos)
+            self.n += len(novos_textos)
+            self._gravar_meta()
+
+            # A cauda é procurada por força bruta; reindexar mantém-na pequena
+            if self.n >= MIN_FATOS_INDICE and self.n - self.n_indexados > MAX_CAUDA:
+                self._reindexar()
+            return len(novos_textos)
+
+    def _reindexar(self, iteracoes=10, semente=42):
+        """Treina um k-means esférico e regrava os vetores agrupados por lista (IVF)."""
+        rng = np.random.default_rng(semente)
+        vetores = np.array(self.vetores[:self.n])
+        n_listas = max(1, int(np.sqrt(self.n)))
+        amostra = vetores[rng.choice(self.n, min(self.n, n_listas * 40), replace=False)]
+        centroides = amostra[rng.choice(len(amostra), n_listas, replace=False)].copy()
+        for _ in range(iteracoes):
+            atribuicao = np.argmax(amostra @ centroides.T, axis=1)
+            somas = np.zeros_like(centroides)
+            np.add.at(somas, atribuicao, amostra)
+            preenchidas = np.linalg.norm(somas, axis=1) > 0
+            centroides[preenchidas] = somas[preenchidas] / np.linalg.norm(somas[preenchidas], axis=1, keepdims=True)
+
+        atribuicao = np.concatenate([
+            np.argmax(vetores[i:i + 8192] @ centroides.T, axis=1) for i in range(0, self.n, 8192)
+        ])
+        ordem = np.argsort(atribuicao, kind="stable")
+        limites = np.searchsorted(atribuicao[ordem], np.arange(n_listas + 1))
+
+        # Grava a nova versão ao lado da atual; nada do que está em uso é alterado
+        nova_versao = self.versao + 1
+        novos = np.lib.format.open_memmap(self._arquivo("vetores.npy", nova_versao), mode="w+", dtype=np.float32, shape=self.vetores.shape)
+        novos[:self.n] = vetores[ordem]
+        novos.flush()
+        del novos
+        fatos = [self.fatos[i] for i in ordem]
+        self._gravar_fatos(fatos, self._arquivo("fatos.jsonl", nova_versao))
+        np.savez(self._arquivo("indice.npz", nova_versao), centroides=centroides, limites=limites)
+
+        # meta.json é o ponto de confirmação: a partir daqui a nova versão passa a valer
+        self.versao, self.n_indexados = nova_versao, self.n
+        self._gravar_meta()
+        self.vetores = np.load(self._arquivo("vetores.npy"), mmap_mode="r+")
+        self.fatos = fatos
+        self.centroides, self.limites = centroides, limites
+        self._apagar_outras_versoes()
+
+    # --- Leitura ---
+
+    def _buscar(self, vetor, k, limiar):
+        if self.centroides is None or self.n_indexados == 0:
+            blocos = [(0, self.n)]
+        else:
+            # Visita as listas mais próximas até ler ~VETORES_POR_CONSULTA vetores,
+            # para a latência ficar estável quando o número de factos cresce
+            proximidade = self.centroides @ vetor
+            por_lista = self.n_indexados / len(proximidade)
+            n_sondas = min(len(proximidade), max(MIN_SONDAS, int(np.ceil(VETORES_POR_CONSULTA / por_lista))))
+            sondas = np.argpartition(-proximidade, n_sondas - 1)[:n_sondas]
+            blocos = [(self.limites[s], self.limites[s + 1]) for s in sondas]
+            blocos.append((self.n_indexados, self.n))  # Cauda ainda não indexada
+        blocos = [(inicio, fim) for inicio, fim in blocos if fim > inicio]
+        if not blocos:
+            return []
+
+        # Cada lista é uma fatia contígua do arquivo mapeado; np.asarray evita o custo
+        # de criar um np.memmap por fatia
+        matriz = np.asarray(self.vetores)
+        pontuacoes = np.concatenate([matriz[inicio:fim] @ vetor for inicio, fim in blocos])
+        if len(pontuacoes) > k:
+            melhores = np.argpartition(-pontuacoes, k)[:k]
+        else:
+            melhores = np.arange(len(pontuacoes))
+        melhores = melhores[np.argsort(-pontuacoes[melhores])]
+
+        # Converte as posições em `pontuacoes` de volta em linhas do arquivo
+        inicios = np.array([inicio for inicio, _ in blocos])
+        deslocamentos = np.cumsum([0] + [fim - inicio for inicio, fim in blocos])
+        bloco = np.searchsorted(deslocamentos, melhores, side="right") - 1
+        linhas = inicios[bloco] + melhores - deslocamentos[bloco]
+        return [(self.fatos[linha], float(pontuacoes[i])) for linha, i in zip(linhas, melhores) if pontuacoes[i] >= limiar]
+
+    def buscar(self, vetor, k=TOP_K, limiar=LIMIAR_RELEVANCIA):
+        """Os `k` factos mais parecidos com `vetor`, como (texto, similaridade)."""
+        with self.lock:
+            if self.n == 0:
+                return []
+            return self._buscar(vetor, k, limiar)
+
+
+_indices = OrderedDict()
+_locks_por_pasta = {}  # Um lock por utilizador; continua a existir depois de o índice sair do cache
+_geracoes = {}         # Incrementada quando a memória do utilizador é apagada
+_lock_indices = threading.Lock()
+
+def _chave_usuario(email):
+    return hashlib.sha256(email.strip().lower().encode("utf-8")).hexdigest()[:32]
+
+def obter_indice(email):
+    """
+    Índice do utilizador; os mais usados ficam abertos (em memória mapeada) entre pedidos.
+    Uma instância que saiu do cache ainda pode estar a ser usada por uma thread; como
+    partilha o lock da pasta e se sincroniza antes de escrever, as duas não se atropelam.
+    """
+    chave = _chave_usuario(email)
+    with _lock_indices:
+        if chave in _indices:
+            _indices.move_to_end(chave)
+            return _indices[chave]
+        lock = _locks_por_pasta.setdefault(chave, threading.RLock())
+
+    # Abre fora do lock global, para não bloquear os outros utilizadores durante a leitura
+    novo = IndiceVetorialUsuario(os.path.join(DIRETORIO_MEMORIA, chave), lock)
+    with _lock_indices:
+        indice = _indices.setdefault(chave, novo)
+        _indices.move_to_end(chave)
+        if len(_indices) > MAX_INDICES_ABERTOS:
+            _indices.popitem(last=False)
+        return indice
+
+def _geracao(email):
+    with _lock_indices:
+        return _geracoes.get(_chave_usuario(email), 0)
+
+def apagar_memoria(email):
+    """Apaga do disco todos os factos do utilizador (ex.: quando a conta é excluída)."""
+    chave = _chave_usuario(email)
+    with _lock_indices:
+        _indices.pop(chave, None)
+        lock = _locks_por_pasta.setdefault(chave, threading.RLock())
+        _geracoes[chave] = _geracoes.get(chave, 0) + 1
+    with lock:
+        shutil.rmtree(os.path.join(DIRETORIO_MEMORIA, chave), ignore_errors=True)
+
+
+# ==========================================================
+# === EXTRAÇÃO E RECUPERAÇÃO
+# ==========================================================
+
+def extrair_fatos(message: str, resposta_anterior: str = ""):
+    """Pede à IA os factos duradouros sobre o utilizador presentes na mensagem."""
+    prompt = f"""Extraia da mensagem do utilizador factos DURADOUROS sobre ele (preferências, profissão,
+projetos, família, restrições, objetivos). Ignore pedidos pontuais e perguntas.
+Escreva cada facto como uma frase curta na terceira pessoa, em português.
+Responda APENAS com JSON no formato {{"fatos": ["..."]}}; use uma lista vazia se não houver nenhum.
+
+Última resposta do assistente (contexto): "{resposta_anterior[:500]}"
+Mensagem do utilizador: "{message}"
+"""
+    resposta = openai_client.chat.completions.create(
+        model='gpt-4o-mini', messages=[{"role": "user", "content": prompt}],
+        response_format={"type": "json_object"}, temperature=0, max_tokens=200
+    )
+    medidor_uso.registrar(resposta.usage, 'gpt-4o-mini')
+    fatos = json.loads(resposta.choices[0].message.content).get("fatos", [])
+    return [f.strip() for f in fatos if isinstance(f, str) and f.strip()]
+
+def memorizar_da_mensagem(email: str, message: str, history: list):
+    """Extrai e guarda os factos de uma mensagem. Pensado para correr em segundo plano."""
+    try:
+        if len(message.strip()) < 15:
+            return
+        # Sem modelo de embeddings os factos não podem ser guardados: não vale a pena
+        # pagar a chamada de extração
+        obter_modelo()
+        geracao = _geracao(email)
+        resposta_anterior = next((m.get("content", "") for m in reversed(history) if m.get("role") == "assistant"), "")
+        fatos = extrair_fatos(message, resposta_anterior)
+        if fatos:
+            vetores = embutir(fatos)
+            indice = obter_indice(email)
+            with indice.lock:
+                if geracao != _geracao(email):
+                    return  # A memória foi apagada enquanto os factos eram extraídos
+                adicionados = indice.adicionar(fatos, vetores)
+            print(f"[DEBUG Memória] {adicionados} facto(s) novo(s) guardado(s) para o utilizador.")
+    except Exception as e:
+        print(f"[ERRO Memória] Falha ao memorizar factos: {e}")
+
+def recuperar_memorias(email: str, message: str, k: int = TOP_K):
+    """Os factos do utilizador mais relevantes para a mensagem atual."""
+    try:
+        indice = obter_indice(email)
+        if indice.n == 0:
+            return []
+        return [texto for texto, _ in indice.buscar(embutir([message])[0], k)]
+    except Exception as e:
+        print(f"[ERRO Memória] Falha ao recuperar memórias: {e}")
+        return []
+
+
+_tarefas_em_segundo_plano = set()
+
+def agendar_memorizacao(email: str, message: str, history: list):
+    """Agenda a extração de factos sem atrasar a resposta ao utilizador."""
+    tarefa = asyncio.create_task(asyncio.to_thread(memorizar_da_mensagem, email, message, history))
+    _tarefas_em_segundo_plano.add(tarefa)
+    tarefa.add_done_callback(_tarefas_em_segundo_plano.discard)
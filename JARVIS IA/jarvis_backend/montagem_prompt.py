@@ -0,0 +1,108 @@
+# montagem_prompt.py
+# Monta as mensagens enviadas à OpenAI do conteúdo mais estável para o mais variável:
+# persona fixa -> arquivo/documento ou instruções da web -> preferências -> histórico
+# -> dicas do turno (idioma, data, resultados da web e memórias relevantes) -> mensagem do utilizador.
+# Assim o início do prompt repete-se entre pedidos e o cache de prefixo do
+# fornecedor (tokens de entrada em cache, mais baratos e rápidos) pode ser aproveitado.
+
+import json
+import threading
+from datetime import datetime, timezone
+
+PERSONA = (
+    "Você é Jarvis, um assistente prestável e amigável. "
+    "Responda sempre na língua do utilizador, indicada nas instruções do turno."
+)
+
+
+def bloco_arquivo(conteudo: str):
+    return (
+        "Você deve basear sua resposta *primariamente* no conteúdo dos seguintes arquivos fornecidos pelo usuário:\n\n"
+        f"--- CONTEÚDO DO ARQUIVO ---\n{conteudo}\n--- FIM DO CONTEÚDO ---"
+    )
+
+# Parte fixa dos turnos com busca na web; os resultados mudam a cada pesquisa e vão
+# nas dicas do turno (ver bloco_web), para o prefixo continuar igual entre pedidos
+INSTRUCOES_WEB = (
+    "Nesta resposta, você resume notícias da web.\n"
+    "INSTRUÇÕES CRÍTICAS: Os resultados da pesquisa já estão no formato de link Markdown "
+    "`* [Título](URL) - Resumo`. A sua resposta final DEVE manter este formato de link."
+)
+
+def bloco_web(resultados: str):
+    return f"RESULTADOS DA PESQUISA:\n{resultados}"
+
+def bloco_preferencias(preferencias: dict):
+    if not preferencias:
+        return None
+    nome_usuario = preferencias.get('nome', 'utilizador')
+    # sort_keys garante os mesmos bytes para as mesmas preferências, pedido após pedido
+    return (
+        f"Contexto sobre o utilizador ({nome_usuario.capitalize()}): "
+        f"{json.dumps(preferencias, ensure_ascii=False, sort_keys=True)}. "
+        "Use essas informações para personalizar as suas respostas sempre que for relevante."
+    )
+
+def bloco_memorias(memorias: list):
+    if not memorias:
+        return None
+    linhas = "\n".join(f"- {memoria}" for memoria in memorias)
+    return f"O que já sabe sobre o utilizador (de conversas anteriores), relevante para esta mensagem:\n{linhas}"
+
+def dicas_do_turno(idioma_usuario: str):
+    hoje = datetime.now(timezone.utc).date().isoformat()
+    return f"Instruções deste turno: responda na língua do utilizador (código: {idioma_usuario}). Data de hoje (UTC): {hoje}."
+
+
+def montar_mensagens(history: list, message: str, idioma_usuario: str, blocos=(), memorias=(), contexto_turno=()):
+    """
+    Devolve a lista de mensagens para a API. `blocos` são os textos de contexto
+    (arquivo, instruções da web, preferências), já na ordem do mais estável para o
+    mais variável; blocos vazios são ignorados. `contexto_turno` (ex.: resultados da
+    web) e `memorias` (ver memoria_longo_prazo.py) mudam a cada mensagem, por isso vão
+    junto das dicas do turno e não no prompt do sistema.
+    """
+    prompt_sistema = "\n\n".join([PERSONA, *[bloco for bloco in blocos if bloco]])
+    dicas = "\n\n".join(filter(None, [
+        dicas_do_turno(idioma_usuario), *contexto_turno, bloco_memorias(list(memorias))
+    ]))
+    return [
+        {"role": "system", "content": prompt_sistema},
+        *history,
+        # As dicas do turno ficam depois do histórico para não quebrar o prefixo em cache
+        {"role": "system", "content": dicas},
+        {"role": "user", "content": message},
+    ]
+
+
+class MetricasCachePrompt:
+    """Acumula os tokens de entrada e os que vieram do cache de prefixo, a partir do `usage` da OpenAI."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.chamadas = 0
+        self.tokens_entrada = 0
+        self.tokens_em_cache = 0
+
+    def registrar(self, usage):
+        if usage is None:
+            return
+        detalhes = getattr(usage, "prompt_tokens_details", None)
+        em_cache = getattr(detalhes, "cached_tokens", 0) or 0
+        with self._lock:
+            self.chamadas += 1
+            self.tokens_entrada += usage.prompt_tokens or 0
+            self.tokens_em_cache += em_cache
+        print(f"[DEBUG Cache] {em_cache}/{usage.prompt_tokens} tokens de entrada vieram do cache.")
+
+    def resumo(self):
+        with self._lock:
+            return {
+                "chamadas": self.chamadas,
+                "tokens_entrada": self.tokens_entrada,
+                "tokens_em_cache": self.tokens_em_cache,
+                "taxa_cache": self.tokens_em_cache / self.tokens_entrada if self.tokens_entrada else None,
+            }
+
+
+metricas_cache_prompt = MetricasCachePrompt()
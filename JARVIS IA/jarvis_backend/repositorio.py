@@ -0,0 +1,297 @@
+# repositorio.py
+# Camada de acesso aos dados do Supabase. Todas as consultas passam por aqui:
+# - cliente assíncrono, com um pool de conexões HTTP mantidas abertas (keep-alive);
+# - consultas de leitura idênticas dentro do mesmo pedido HTTP são feitas uma só vez;
+# - operações que tocam várias tabelas (ex.: excluir utilizador) são um único RPC
+#   transacional (ver sql/usuarios.sql).
+# RepositorioMemoria implementa a mesma interface sem rede, para benchmarks offline.
+
+import asyncio
+import contextvars
+import httpx
+from supabase import acreate_client
+from supabase.lib.client_options import AsyncClientOptions
+
+COLUNAS_USUARIO = "nome, email, role, data_expiracao"
+TAMANHO_PAGINA_USO = 1000  # max-rows padrão do PostgREST
+
+# Cache das leituras do pedido atual (criado pelo middleware em main.py)
+_memo_do_pedido = contextvars.ContextVar("memo_do_pedido", default=None)
+
+
+def iniciar_memo_do_pedido():
+    return _memo_do_pedido.set({})
+
+def encerrar_memo_do_pedido(token):
+    _memo_do_pedido.reset(token)
+
+
+class RepositorioBase:
+    """Memoização por pedido, partilhada pelas implementações."""
+
+    async def _memoizar(self, chave, consulta):
+        memo = _memo_do_pedido.get()
+        if memo is None:
+            return await consulta()
+        if chave not in memo:
+            # Guarda a tarefa (e não o resultado) para que consultas simultâneas também a partilhem
+            memo[chave] = asyncio.ensure_future(consulta())
+        return await memo[chave]
+
+    def _invalidar_memo(self):
+        memo = _memo_do_pedido.get()
+        if memo is not None:
+            memo.clear()
+
+
+class RepositorioSupabase(RepositorioBase):
+    def __init__(self, cliente, http_client):
+        self.cliente = cliente
+        self.http_client = http_client
+
+    @classmethod
+    async def criar(cls, url, chave, max_conexoes=20):
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_conexoes, max_keepalive_connections=max_conexoes, keepalive_expiry=60),
+            timeout=httpx.Timeout(30.0),
+        )
+        cliente = await acreate_client(url, chave, options=AsyncClientOptions(httpx_client=http_client))
+        return cls(cliente, http_client)
+
+    async def fechar(self):
+        await self.http_client.aclose()
+
+    # --- Utilizadores ---
+
+    async def buscar_usuario(self, email):
+        async def consulta():
+            response = await self.cliente.table('usuarios').select(COLUNAS_USUARIO).eq('email', email).execute()
+            return response.data[0] if response.data else None
+        return await self._memoizar(("usuario", email), consulta)
+
+    async def buscar_credenciais(self, email):
+        response = await self.cliente.table('usuarios').select("email, senha_hash, role, data_expiracao").eq('email', email).execute()
+        return response.data[0] if response.data else None
+
+    async def listar_usuarios(self):
+        response = await self.cliente.table('usuarios').select(COLUNAS_USUARIO).execute()
+        return response.data
+
+    async def criar_usuario(self, dados):
+        self._invalidar_memo()
+        response = await self.cliente.table('usuarios').insert(dados).execute()
+        return response.data
+
+    async def atualizar_usuario(self, email, dados):
+        self._invalidar_memo()
+        response = await self.cliente.table('usuarios').update(dados).eq('email', email).execute()
+        return response.data
+
+    async def excluir_usuario(self, email):
+        """Exclui o utilizador e as suas preferências numa única transação. Retorna True se existia."""
+        self._invalidar_memo()
+        response = await self.cliente.rpc('excluir_usuario', {"p_email": email}).execute()
+        return bool(response.data)
+
+    # --- Preferências ---
+
+    async def listar_preferencias(self, email):
+        async def consulta():
+            response = await self.cliente.table('preferencias').select('id, topico, valor').eq('user_email', email).execute()
+            return response.data
+        return await self._memoizar(("preferencias", email), consulta)
+
+    async def criar_preferencia(self, email, topico, valor):
+        self._invalidar_memo()
+        response = await self.cliente.table('preferencias').insert({
+            "user_email": email, "topico": topico, "valor": valor
+        }).execute()
+        return response.data
+
+    async def salvar_preferencia(self, email, topico, valor):
+        self._invalidar_memo()
+        response = await self.cliente.table('preferencias').upsert(
+            {"user_email": email, "topico": topico, "valor": valor}, on_conflict='user_email, topico'
+        ).execute()
+        return response.data
+
+    async def atualizar_preferencia(self, pref_id, email, valor):
+        self._invalidar_memo()
+        response = await self.cliente.table('preferencias').update({"valor": valor}).eq('id', pref_id).eq('user_email', email).execute()
+        return response.data
+
+    async def excluir_preferencia(self, pref_id, email):
+        self._invalidar_memo()
+        response = await self.cliente.table('preferencias').delete().eq('id', pref_id).eq('user_email', email).execute()
+        return response.data
+
+    # --- Uso de tokens (ver medicao_uso.py) ---
+
+    async def registrar_uso_tokens(self, lote_id, linhas):
+        await self.cliente.rpc("registrar_uso_tokens", {"p_lote_id": lote_id, "p_linhas": linhas}).execute()
+
+    async def listar_uso_tokens(self, desde):
+        # Somado no banco (sql/uso_tokens.sql); paginado porque o PostgREST corta em 1000 linhas
+        linhas, inicio = [], 0
+        while True:
+            response = await self.cliente.rpc(
+                'uso_tokens_por_usuario', {'p_desde': desde}
+            ).range(inicio, inicio + TAMANHO_PAGINA_USO - 1).execute()
+            pagina = response.data or []
+            linhas.extend(pagina)
+            if len(pagina) < TAMANHO_PAGINA_USO:
+                return linhas
+            inicio += TAMANHO_PAGINA_USO
+
+
+class RepositorioMemoria(RepositorioBase):
+    """
+    Dublê em memória do RepositorioSupabase, sem rede.
+    `latencia_segundos` simula o tempo de ida e volta de cada consulta;
+    `consultas` conta quantas idas ao "banco" foram feitas.
+    """
+
+    def __init__(self, latencia_segundos=0.0):
+        self.latencia_segundos = latencia_segundos
+        self.consultas = 0
+        self.usuarios = {}      # email -> linha
+        self.preferencias = {}  # id -> linha
+        self.uso_tokens = {}    # (email, modelo, dia) -> linha
+        self.lotes_aplicados = set()
+        self._proximo_id = 1
+
+    async def _ida_e_volta(self):
+        self.consultas += 1
+        if self.latencia_segundos:
+            await asyncio.sleep(self.latencia_segundos)
+
+    async def fechar(self):
+        pass
+
+    # --- Utilizadores ---
+
+    async def buscar_usuario(self, email):
+        async def consulta():
+            await self._ida_e_volta()
+            usuario = self.usuarios.get(email)
+            return {c: usuario.get(c) for c in COLUNAS_USUARIO.split(", ")} if usuario else None
+        return await self._memoizar(("usuario", email), consulta)
+
+    async def buscar_credenciais(self, email):
+        await self._ida_e_volta()
+        return dict(self.usuarios[email]) if email in self.usuarios else None
+
+    async def listar_usuarios(self):
+        await self._ida_e_volta()
+        return [{c: u.get(c) for c in COLUNAS_USUARIO.split(", ")} for u in self.usuarios.values()]
+
+    async def criar_usuario(self, dados):
+        self._invalidar_memo()
+        await self._ida_e_volta()
+        if dados["email"] in self.usuarios:
+            return []
+        self.usuarios[dados["email"]] = dict(dados)
+        return [dict(dados)]
+
+    async def atualizar_usuario(self, email, dados):
+        self._invalidar_memo()
+        await self._ida_e_volta()
+        if email not in self.usuarios:
+            return []
+        self.usuarios[email].update(dados)
+        return [dict(self.usuarios[email])]
+
+    async def excluir_usuario(self, email):
+        self._invalidar_memo()
+        await self._ida_e_volta()
+        self.preferencias = {i: p for i, p in self.preferencias.items() if p["user_email"] != email}
+        return self.usuarios.pop(email, None) is not None
+
+    # --- Preferências ---
+
+    async def listar_preferencias(self, email):
+        async def consulta():
+            await self._ida_e_volta()
+            return [
+                {"id": p["id"], "topico": p["topico"], "valor": p["valor"]}
+                for p in self.preferencias.values() if p["user_email"] == email
+            ]
+        return await self._memoizar(("preferencias", email), consulta)
+
+    def _buscar_preferencia(self, email, topico):
+        return next((p for p in self.preferencias.values() if p["user_email"] == email and p["topico"] == topico), None)
+
+    async def criar_preferencia(self, email, topico, valor):
+        self._invalidar_memo()
+        await self._ida_e_volta()
+        if self._buscar_preferencia(email, topico):
+            return []
+        linha = {"id": self._proximo_id, "user_email": email, "topico": topico, "valor": valor}
+        self.preferencias[self._proximo_id] = linha
+        self._proximo_id += 1
+        return [dict(linha)]
+
+    async def salvar_preferencia(self, email, topico, valor):
+        existente = self._buscar_preferencia(email, topico)
+        if existente is None:
+            return await self.criar_preferencia(email, topico, valor)
+        return await self.atualizar_preferencia(existente["id"], email, valor)
+
+    async def atualizar_preferencia(self, pref_id, email, valor):
+        self._invalidar_memo()
+        await self._ida_e_volta()
+        linha = self.preferencias.get(pref_id)
+        if not linha or linha["user_email"] != email:
+            return []
+        linha["valor"] = valor
+        return [dict(linha)]
+
+    async def excluir_preferencia(self, pref_id, email):
+        self._invalidar_memo()
+        await self._ida_e_volta()
+        linha = self.preferencias.get(pref_id)
+        if not linha or linha["user_email"] != email:
+            return []
+        return [self.preferencias.pop(pref_id)]
+
+    # --- Uso de tokens ---
+
+    async def registrar_uso_tokens(self, lote_id, linhas):
+        await self._ida_e_volta()
+        if lote_id in self.lotes_aplicados:
+            return
+        self.lotes_aplicados.add(lote_id)
+        for linha in linhas:
+            chave = (linha["user_email"], linha["modelo"], linha["dia"])
+            atual = self.uso_tokens.setdefault(chave, {
+                "user_email": linha["user_email"], "modelo": linha["modelo"], "dia": linha["dia"],
+                "chamadas": 0, "tokens_entrada": 0, "tokens_saida": 0, "tokens_em_cache": 0
+            })
+            for campo in ("chamadas", "tokens_entrada", "tokens_saida", "tokens_em_cache"):
+                atual[campo] += linha[campo]
+
+    async def listar_uso_tokens(self, desde):
+        await self._ida_e_volta()
+        totais = {}
+        for l in self.uso_tokens.values():
+            if l["dia"] < desde:
+                continue
+            total = totais.setdefault((l["user_email"], l["modelo"]), {
+                "user_email": l["user_email"], "modelo": l["modelo"], "chamadas": 0,
+                "tokens_entrada": 0, "tokens_saida": 0, "tokens_em_cache": 0,
+            })
+            for campo in ("chamadas", "tokens_entrada", "tokens_saida", "tokens_em_cache"):
+                total[campo] += l[campo]
+        return [totais[chave] for chave in sorted(totais)]
+
+
+_repositorio = None
+
+def definir_repositorio(repositorio):
+    global _repositorio
+    _repositorio = repositorio
+
+def obter_repositorio():
+    if _repositorio is None:
+        raise RuntimeError("Repositório não inicializado: o evento de startup da aplicação ainda não foi executado.")
+    return _repositorio
@@ -0,0 +1,76 @@
+-- uso_tokens.sql
+-- Tabela agregada de consumo de tokens (uma linha por utilizador, modelo e dia)
+-- e o RPC usado por medicao_uso.py para aplicar cada lote uma única vez.
+
+create table if not exists uso_tokens (
+    user_email text not null,
+    modelo text not null,
+    dia date not null,
+    chamadas bigint not null default 0,
+    tokens_entrada bigint not null default 0,
+    tokens_saida bigint not null default 0,
+    tokens_em_cache bigint not null default 0,
+    primary key (user_email, modelo, dia)
+);
+
+-- Lotes já aplicados: permite reenviar um lote sem somar os valores duas vezes
+create table if not exists uso_tokens_lotes (
+    lote_id uuid primary key,
+    aplicado_em timestamptz not null default now()
+);
+
+create or replace function registrar_uso_tokens(p_lote_id uuid, p_linhas jsonb)
+returns void
+language plpgsql
+as $$
+begin
+    insert into uso_tokens_lotes (lote_id) values (p_lote_id)
+    on conflict (lote_id) do nothing;
+    if not found then
+        return;  -- Lote já aplicado numa tentativa anterior
+    end if;
+
+    insert into uso_tokens (user_email, modelo, dia, chamadas, tokens_entrada, tokens_saida, tokens_em_cache)
+    select user_email, modelo, dia, chamadas, tokens_entrada, tokens_saida, tokens_em_cache
+    from jsonb_to_recordset(p_linhas) as l(
+        user_email text, modelo text, dia date, chamadas bigint,
+        tokens_entrada bigint, tokens_saida bigint, tokens_em_cache bigint
+    )
+    on conflict (user_email, modelo, dia) do update set
+        chamadas = uso_tokens.chamadas + excluded.chamadas,
+        tokens_entrada = uso_tokens.tokens_entrada + excluded.tokens_entrada,
+        tokens_saida = uso_tokens.tokens_saida + excluded.tokens_saida,
+        tokens_em_cache = uso_tokens.tokens_em_cache + excluded.tokens_em_cache;
+end;
+$$;
+
+-- Escreve o consumo de qualquer utilizador: apenas a service key do backend pode chamar
+revoke execute on function registrar_uso_tokens(uuid, jsonb) from public, anon, authenticated;
+grant execute on function registrar_uso_tokens(uuid, jsonb) to service_role;
+
+-- Totais por utilizador e modelo desde `p_desde`, somados no banco: o painel de
+-- administração lê uma linha por (utilizador, modelo) em vez de uma por dia.
+create or replace function uso_tokens_por_usuario(p_desde date)
+returns table (
+    user_email text,
+    modelo text,
+    chamadas bigint,
+    tokens_entrada bigint,
+    tokens_saida bigint,
+    tokens_em_cache bigint
+)
+language sql
+stable
+as $$
+    select u.user_email, u.modelo,
+           sum(u.chamadas)::bigint, sum(u.tokens_entrada)::bigint,
+           sum(u.tokens_saida)::bigint, sum(u.tokens_em_cache)::bigint
+    from uso_tokens u
+    where u.dia >= p_desde
+    group by u.user_email, u.modelo
+    order by u.user_email, u.modelo;
+$$;
+
+-- Expõe o consumo de todos os utilizadores: apenas a service key pode chamar
+revoke execute on function uso_tokens_por_usuario(date) from public, anon, authenticated;
+grant execute on function uso_tokens_por_usuario(date) to service_role;
@@ -0,0 +1,18 @@
+-- usuarios.sql
+-- RPC usado por repositorio.py para excluir um utilizador e as suas preferências
+-- numa única transação (um só pedido HTTP ao Supabase).
+
+create or replace function excluir_usuario(p_email text)
+returns boolean
+language plpgsql
+as $$
+begin
+    delete from preferencias where user_email = p_email;
+    delete from usuarios where email = p_email;
+    return found;  -- true se o utilizador existia
+end;
+$$;
+
+-- Apaga qualquer utilizador: apenas a service key do backend pode chamar
+revoke execute on function excluir_usuario(text) from public, anon, authenticated;
+grant execute on function excluir_usuario(text) to service_role;
@@ -9,17 +9,53 @@ import requests
 import base64
 import time
 import io 
-from fpdf import FPDF
-from fpdf.enums import XPos, YPos
+import asyncio
+from openpyxl import load_workbook
 from openai import RateLimitError
 from config import openai_client
 from fastapi import UploadFile 
+from data_analysis import resumir_dataframe
+from exportacao_pdf import renderizar_texto
+from medicao_uso import medidor_uso
+
+EXTENSOES_TABULARES = (".csv", ".xlsx", ".xls")
+# CSVs que o Pandas não consegue ler (ex.: linhas com números de colunas diferentes)
+# seguem como texto, cortado no mesmo limite que core_logic aplica ao contexto de arquivos
+LIMITE_CSV_COMO_TEXTO = 20000 * 4
+
+def carregar_planilha(content: bytes, filename: str):
+    """
+    Carrega um CSV ou planilha Excel em um DataFrame.
+    Arquivos .xlsx são lidos em modo somente leitura, linha a linha, sem montar
+    o modelo completo da pasta de trabalho na memória.
+    """
+    if filename.endswith(".csv"):
+        return pd.read_csv(io.BytesIO(content), encoding_errors="ignore")
+
+    if filename.endswith(".xlsx"):
+        wb = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+        try:
+            linhas = wb.active.iter_rows(values_only=True)
+            cabecalho = next(linhas, None) or ()
+            colunas = [str(c) if c is not None else f"coluna_{i + 1}" for i, c in enumerate(cabecalho)]
+            df = pd.DataFrame.from_records(list(linhas), columns=colunas)
+        finally:
+            wb.close()
+        return df.dropna(how="all")
+
+    return pd.read_excel(io.BytesIO(content))
+
+def _carregar_e_resumir(content: bytes, filename: str):
+    df = carregar_planilha(content, filename)
+    return df, resumir_dataframe(df)
 
 # <--- UPLOAD DE MÚLTIPLOS ARQUIVOS --->
-async def extrair_texto_de_upload(file: UploadFile):
+async def extrair_texto_de_upload(file: UploadFile, tabelas: dict = None):
     """
     Extrai texto de uma vasta gama de tipos de arquivo, incluindo documentos,
     código-fonte de várias linguagens e arquivos de dados.
+    Planilhas viram um resumo compacto; se `tabelas` for informado, o DataFrame
+    completo é guardado nele com o nome do arquivo como chave.
     Esta função é assíncrona para trabalhar com o FastAPI.
     """
     filename = file.filename.lower()
@@ -40,18 +76,20 @@ async def extrair_texto_de_upload(file: UploadFile):
         except Exception as e:
             return f"Erro ao processar .docx: {e}"
 
-    # --- Arquivos de Dados (convertidos para texto/CSV) ---
-    elif filename.endswith(".csv"):
-        # O próprio CSV já é texto, então apenas decodificamos
-        return content.decode("utf-8", errors="ignore")
-        
-    elif filename.endswith((".xlsx", ".xls")):
+    # --- Arquivos de Dados (resumo tabular compacto) ---
+    elif filename.endswith(EXTENSOES_TABULARES):
         try:
-            df = pd.read_excel(io.BytesIO(content))
-            # Converte o DataFrame para uma string no formato CSV para a IA ler
-            return df.to_csv(index=False)
+            # Leitura e resumo podem levar segundos em arquivos grandes: fora do event loop
+            df, resumo = await asyncio.to_thread(_carregar_e_resumir, content, filename)
         except Exception as e:
-            return f"Erro ao processar planilha Excel: {e}"
+            if filename.endswith(".csv"):
+                print(f"[DEBUG] CSV não tabular ({e}); a enviar como texto.")
+                return content.decode("utf-8", errors="ignore")[:LIMITE_CSV_COMO_TEXTO]
+            return f"Erro ao processar planilha: {e}"
+        # Guarda o DataFrame completo para análises posteriores; a IA recebe só o resumo
+        if tabelas is not None:
+            tabelas[file.filename] = df
+        return resumo
 
     # --- Arquivos de Código, Scripts e Texto Simples ---
     elif filename.endswith((
@@ -100,22 +138,8 @@ def extrair_texto_documento(uploaded_file_bytes, filename):
 # --- Funções de Geração (PDF, etc.) ---
 
 def criar_pdf(texto_corpo, titulo_documento):
-    pdf = FPDF()
-    pdf.add_page()
-    script_dir = os.path.dirname(__file__)
-    font_path_regular = os.path.join(script_dir, 'assets', 'DejaVuSans.ttf')
-    font_path_bold = os.path.join(script_dir, 'assets', 'DejaVuSans-Bold.ttf')
-    try:
-        pdf.add_font('DejaVu', '', font_path_regular)
-        pdf.add_font('DejaVu', 'B', font_path_bold)
-        FONT_FAMILY = 'DejaVu'
-    except Exception:
-        FONT_FAMILY = 'Helvetica'
-    pdf.set_font(FONT_FAMILY, 'B', 18)
-    pdf.multi_cell(0, 10, titulo_documento, new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
-    pdf.ln(15)
-    # ... (resto da sua lógica de formatação do PDF) ...
-    return bytes(pdf.output())
+    # As fontes ficam em cache no processo (ver exportacao_pdf.py)
+    return renderizar_texto(texto_corpo, titulo_documento)
 
 # --- Funções Auxiliares de IA ---
 
@@ -127,6 +151,7 @@ def chamar_openai_com_retries(mensagens, modelo="gpt-4o-mini", max_tentativas=3,
                 model=modelo,
                 messages=mensagens
             )
+            medidor_uso.registrar(resposta.usage, modelo)
             return resposta
         except RateLimitError:
             print(f"AVISO: RateLimitError. Tentando novamente em {pausa_segundos}s...")
@@ -145,6 +170,7 @@ def detectar_idioma_com_ia(texto_usuario):
             messages=[{"role": "user", "content": prompt}],
             max_tokens=5
         )
+        medidor_uso.registrar(resposta_modelo.usage, 'gpt-4o-mini')
         idioma = resposta_modelo.choices[0].message.content.strip().lower()
         return idioma if len(idioma) == 2 else 'pt'
     except Exception as e: